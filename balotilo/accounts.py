@@ -0,0 +1,269 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import yaml
+from requests.adapters import BaseAdapter
+
+import scheduler
+from elections import (
+    MAPPING_FILE,
+    list_election_dirs,
+    load_config,
+    load_mapping,
+    save_mapping,
+)
+from main import ROOT_DIR, BalotiloAutomation
+
+# Sharding of elections over several Balotilo organizer accounts, so that the
+# per-account throttling of the server does not cap the throughput. Each account
+# gets its own session, request rate budget and cached login, and the account
+# owning each election is recorded for later management and support actions.
+
+logger = logging.getLogger(__name__)
+
+SESSIONS_DIR = ".balotilo_sessions"
+
+
+def load_accounts(accounts_file):
+    """Load the organizer accounts, a YAML list of username/password entries.
+
+    Each entry may also set ``requests_per_minute`` (default: 60).
+    """
+    with open(accounts_file, "r") as f:
+        accounts = yaml.safe_load(f) or []
+    for account in accounts:
+        if not account.get("username") or not account.get("password"):
+            raise ValueError(
+                f"Account entry without username or password in {accounts_file}"
+            )
+        account.setdefault("requests_per_minute", 60)
+    return accounts
+
+
+class RateBudget:
+    """Token bucket allowing a number of requests per minute, with small bursts."""
+
+    def __init__(self, requests_per_minute, burst=5):
+        self.interval = 60.0 / requests_per_minute
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) / self.interval
+        )
+        self.updated = now
+
+    def acquire(self):
+        with self._lock:
+            self._refill()
+            wait = (1 - self.tokens) * self.interval if self.tokens < 1 else 0.0
+            self.tokens -= 1
+        if wait:
+            time.sleep(wait)
+
+    def try_acquire(self):
+        """Spend a token if one is available right away, without waiting."""
+        with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RateLimitedAdapter(BaseAdapter):
+    """Transport adapter spending a rate budget token before each request."""
+
+    def __init__(self, budget, inner):
+        super().__init__()
+        self.budget = budget
+        self.inner = inner
+
+    def send(self, request, **kwargs):
+        self.budget.acquire()
+        return self.inner.send(request, **kwargs)
+
+    def close(self):
+        self.inner.close()
+
+
+def session_cache_file(username):
+    digest = hashlib.sha256(username.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(ROOT_DIR, SESSIONS_DIR, f"{digest}.json")
+
+
+def login_with_cache(automation):
+    """Reuse the cached session cookies of an account, logging in again if expired."""
+    cache_file = session_cache_file(automation.username)
+    if os.path.exists(cache_file):
+        with open(cache_file, "r") as f:
+            automation.session.cookies.update(json.load(f))
+        response = automation.session.get(f"{automation.base_url}/consultations")
+        if "My elections" in response.text or "Create an election" in response.text:
+            logger.info(f"Reusing cached session of {automation.username}")
+            return True
+        automation.session.cookies.clear()
+
+    if not automation.login():
+        return False
+
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    fd = os.open(cache_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(automation.session.cookies.get_dict(), f)
+    return True
+
+
+def account_automation(account, base_url="https://www.balotilo.org"):
+    """A BalotiloAutomation for an account, with its own rate-limited session."""
+    automation = BalotiloAutomation(account["username"], account["password"], base_url)
+    budget = RateBudget(account["requests_per_minute"])
+    # Hedged duplicates are sent from within the transport adapter
+    automation.transport.budget = budget
+    for prefix in ("https://", "http://"):
+        automation.session.mount(
+            prefix, RateLimitedAdapter(budget, automation.session.adapters[prefix])
+        )
+    return automation
+
+
+def process_sharded(accounts, elections_dir="elections/"):
+    """Create the elections of a directory, sharded over several accounts.
+
+    Elections already present in the mapping file are skipped, so an
+    interrupted run can simply be started again. The shards of the accounts
+    which could not log in are given to the other accounts. Returns the names
+    of the elections which could not be created.
+    """
+    elections_dir = os.path.join(ROOT_DIR, elections_dir)
+    config = load_config(elections_dir)
+    if config is None:
+        return None
+
+    mapping = load_mapping(elections_dir)
+    pending = [
+        dir_path
+        for dir_path in list_election_dirs(elections_dir)
+        if os.path.basename(dir_path) not in mapping
+    ]
+    model = scheduler.CostModel(elections_dir)
+    estimates = model.estimate(pending)
+    lock = threading.Lock()
+    automations = {}
+    # Accounts which could not log in, the elections given to them, and the
+    # elections whose creation failed
+    login_failed = set()
+    orphaned = []
+    failed = []
+
+    def run_shard(account, shard):
+        automation = automations.get(account["username"])
+        if automation is None:
+            try:
+                automation = account_automation(account)
+                if not login_with_cache(automation):
+                    raise RuntimeError("login failed")
+            except Exception as e:
+                logger.error(
+                    f"Could not log in with account {account['username']}: {str(e)}"
+                )
+                with lock:
+                    login_failed.add(account["username"])
+                    orphaned.extend(shard)
+                return
+            with lock:
+                automations[account["username"]] = automation
+        for dir_path in shard:
+            start = time.perf_counter()
+            try:
+                election_id = automation.process_election(config, dir_path)
+            except Exception as e:
+                logger.error(f"Error creating {dir_path}: {str(e)}")
+                election_id = None
+            duration = time.perf_counter() - start
+            if not election_id:
+                with lock:
+                    failed.append(dir_path)
+                continue
+            estimate = estimates[dir_path]
+            with lock:
+                mapping[os.path.basename(dir_path)] = {
+                    "account": account["username"],
+                    "election_id": election_id,
+                }
+                save_mapping(elections_dir, mapping)
+                model.record(
+                    dir_path, estimate["features"], estimate["predicted"], duration
+                )
+
+    def run_shards(accounts, dir_paths):
+        shards = scheduler.balance(
+            {dir_path: estimates[dir_path] for dir_path in dir_paths}, len(accounts)
+        )
+        threads = []
+        for account, shard in zip(accounts, shards):
+            if not shard:
+                continue
+            logger.info(
+                f"Account {account['username']}: {len(shard)} elections, "
+                f"{sum(estimates[d]['predicted'] for d in shard):.0f}s predicted"
+            )
+            thread = threading.Thread(target=run_shard, args=(account, shard))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+    run_shards(accounts, pending)
+    # Accounts left without elections log in only when given some, so this ends
+    # once every account either logged in or failed to
+    while orphaned:
+        available = [a for a in accounts if a["username"] not in login_failed]
+        if not available:
+            break
+        logger.info(
+            f"Giving {len(orphaned)} elections of the accounts which could not "
+            f"log in to the {len(available)} other accounts"
+        )
+        dir_paths = list(orphaned)
+        orphaned.clear()
+        run_shards(available, dir_paths)
+
+    model.save()
+    logger.info(f"Election to account mapping saved in {MAPPING_FILE}")
+    not_created = sorted(os.path.basename(d) for d in orphaned + failed)
+    if not_created:
+        logger.error(
+            f"{len(not_created)} elections not created: {', '.join(not_created)}"
+        )
+    return not_created
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Create Balotilo elections sharded over several organizer accounts"
+    )
+    parser.add_argument(
+        "accounts_file", help="YAML file listing the accounts usernames and passwords"
+    )
+    parser.add_argument(
+        "--elections-dir",
+        default="elections/",
+        help="Directory containing election data (default: elections/)",
+    )
+
+    args = parser.parse_args()
+
+    not_created = process_sharded(load_accounts(args.accounts_file), args.elections_dir)
+    if not_created is None or not_created:
+        sys.exit(1)
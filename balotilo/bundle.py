@@ -0,0 +1,226 @@
+import argparse
+import logging
+import mmap
+import os
+
+import yaml
+
+try:
+    import msgpack
+except ImportError:  # Optional dependency, installed with the "bundle" extra
+    msgpack = None
+
+try:
+    from compression import open_input
+    from elections import find_election_files, list_election_dirs
+except ImportError:  # Imported by the preprocessing scripts from the repository root
+    from balotilo.compression import open_input
+    from balotilo.elections import find_election_files, list_election_dirs
+
+# Compact binary intermediate format between the preprocessing stages and the
+# election creation. Each department folder can hold a bundle.msgpack with its
+# candidate lists and voters, and a whole campaign can be packed in a single
+# campaign.msgpack, memory mapped when loaded. The human-readable candidates.yaml
+# and voters.txt can always be exported back from the bundles. A bundle may hold
+# only the candidates or only the voters, the other half then comes from the
+# folder files.
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_FILE = "bundle.msgpack"
+CAMPAIGN_FILE = "campaign.msgpack"
+ROWS_SUFFIX = ".msgpack"
+
+
+def _require_msgpack():
+    if msgpack is None:
+        raise RuntimeError(
+            "The msgpack package is required for bundles, install it with "
+            "`poetry install --extras bundle`"
+        )
+
+
+def _write(path, data):
+    _require_msgpack()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(msgpack.packb(data, use_bin_type=True))
+    os.replace(tmp_path, path)
+
+
+def _read(path):
+    _require_msgpack()
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return msgpack.unpackb(data, raw=False)
+
+
+def write_rows(path, rows):
+    """Write table rows (lists of cells) next to their CSV equivalent."""
+    _write(path, [list(row) for row in rows])
+
+
+def read_rows(path):
+    return _read(path) or []
+
+
+def read_bundle(dir_path):
+    """Bundle of a department folder, or None if it has none."""
+    path = os.path.join(dir_path, BUNDLE_FILE)
+    if not os.path.exists(path):
+        return None
+    return _read(path)
+
+
+def read_fresh_bundle(dir_path):
+    """Bundle of a department folder, without the fields its files are newer than.
+
+    A folder file written after the bundle, like a voters.txt filtered again
+    without --bundle, replaces the bundle field it holds. Returns {} if the
+    folder has no bundle.
+    """
+    bundle = read_bundle(dir_path)
+    if bundle is None:
+        return {}
+    bundled_at = os.path.getmtime(os.path.join(dir_path, BUNDLE_FILE))
+    voters_file, candidates_file = find_election_files(dir_path)
+    for field, path in (("candidates", candidates_file), ("voters", voters_file)):
+        if field in bundle and path and os.path.getmtime(path) > bundled_at:
+            logger.warning(
+                f"{path} is newer than {BUNDLE_FILE}, using it for the {field}"
+            )
+            del bundle[field]
+    return bundle
+
+
+def update_bundle(dir_path, candidates=None, voters=None):
+    """Set the candidate lists and/or voters of a department bundle."""
+    bundle = read_bundle(dir_path) or {}
+    if candidates is not None:
+        bundle["candidates"] = candidates
+    if voters is not None:
+        bundle["voters"] = list(voters)
+    _write(os.path.join(dir_path, BUNDLE_FILE), bundle)
+    return bundle
+
+
+def _data_files(dir_path):
+    """Files an election data is loaded from, bundle and folder files."""
+    voters_file, candidates_file = find_election_files(dir_path)
+    paths = [os.path.join(dir_path, BUNDLE_FILE), voters_file, candidates_file]
+    return [path for path in paths if path and os.path.exists(path)]
+
+
+def load_campaign(elections_dir):
+    """Bundles of a whole campaign by folder name, or {} without campaign file.
+
+    The campaign file is ignored when the files of any folder changed after it
+    was packed, the elections are then loaded from their folders.
+    """
+    path = os.path.join(elections_dir, CAMPAIGN_FILE)
+    if not os.path.exists(path):
+        return {}
+    packed_at = os.path.getmtime(path)
+    stale = [
+        os.path.basename(dir_path)
+        for dir_path in list_election_dirs(elections_dir)
+        if any(os.path.getmtime(f) > packed_at for f in _data_files(dir_path))
+    ]
+    if stale:
+        logger.warning(
+            f"{CAMPAIGN_FILE} is older than the files of {', '.join(stale)}, "
+            f"ignoring it: run `bundle.py pack` again to use it"
+        )
+        return {}
+    return _read(path) or {}
+
+
+def load_election_data(dir_path, bundle=None):
+    """Candidate lists and voters of an election, from its bundle or its files.
+
+    Returns (candidates, voters) where voters is a list of emails, or
+    (None, None) if the election misses its candidates or its voters, in both
+    its bundle and its files.
+    """
+    if bundle is None:
+        bundle = read_fresh_bundle(dir_path)
+    candidates = bundle.get("candidates")
+    voters = bundle.get("voters")
+    if candidates is not None and voters is not None:
+        return candidates, voters
+
+    voters_file, candidates_file = find_election_files(dir_path)
+    if candidates is None:
+        if not candidates_file:
+            return None, None
+        with open_input(candidates_file) as f:
+            candidates = yaml.safe_load(f)
+    if voters is None:
+        if not voters_file:
+            return None, None
+        with open_input(voters_file) as f:
+            voters = [line.strip() for line in f if line.strip()]
+    return candidates, voters
+
+
+def pack_campaign(elections_dir):
+    """Pack the bundles (or files) of every department into a campaign file."""
+    campaign = {}
+    for dir_path in list_election_dirs(elections_dir):
+        candidates, voters = load_election_data(dir_path)
+        if candidates is not None:
+            campaign[os.path.basename(dir_path)] = {
+                "candidates": candidates,
+                "voters": voters,
+            }
+    _write(os.path.join(elections_dir, CAMPAIGN_FILE), campaign)
+    return campaign
+
+
+def export_campaign(elections_dir):
+    """Write back candidates.yaml and voters.txt from the bundles of a campaign."""
+    campaign = load_campaign(elections_dir)
+    exported = 0
+    for dir_path in list_election_dirs(elections_dir):
+        candidates, voters = load_election_data(
+            dir_path, campaign.get(os.path.basename(dir_path))
+        )
+        if candidates is None:
+            continue
+        with open(
+            os.path.join(dir_path, "candidates.yaml"), "w", encoding="utf-8"
+        ) as f:
+            yaml.dump(
+                candidates,
+                f,
+                default_flow_style=False,
+                allow_unicode=True,
+                sort_keys=False,
+            )
+        with open(os.path.join(dir_path, "voters.txt"), "w", encoding="utf-8") as f:
+            for email in voters:
+                f.write(f"{email}\n")
+        exported += 1
+    return exported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Pack election bundles into a campaign file, or export them as YAML/TXT"
+    )
+    parser.add_argument("command", choices=["pack", "export"])
+    parser.add_argument(
+        "--elections-dir",
+        default="elections/",
+        help="Directory containing election data (default: elections/)",
+    )
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        campaign = pack_campaign(args.elections_dir)
+        print(f"Packed {len(campaign)} elections into {CAMPAIGN_FILE}")
+    else:
+        exported = export_campaign(args.elections_dir)
+        print(f"Exported {exported} elections as candidates.yaml and voters.txt")
@@ -0,0 +1,248 @@
+import base64
+import gzip
+import io
+import json
+import logging
+import re
+import threading
+import time
+import urllib.parse
+from collections import defaultdict, deque
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+# Record/replay of the HTTP exchanges made by BalotiloAutomation.
+# A cassette is a gzip-compressed JSON-lines file, one exchange per line,
+# with credentials, CSRF tokens and cookies scrubbed before anything is written
+# to disk, in the requests as well as in the pages received.
+
+logger = logging.getLogger(__name__)
+
+SCRUBBED = "<scrubbed>"
+
+# Form fields whose values must never end up in a cassette
+SECRET_FIELDS = {"user_session[password]", "authenticity_token"}
+
+# Headers whose values must never end up in a cassette
+SECRET_HEADERS = {"cookie", "set-cookie", "x-csrf-token", "authorization"}
+
+# CSRF tokens embedded in pages, replaced by a placeholder the parsers still find
+SCRUBBED_TOKEN = b"scrubbed"
+SECRET_BODY_PATTERNS = [
+    re.compile(
+        rb'(<meta\s(?=[^>]*name="csrf-token")[^>]*content=")[^"]*(")', re.IGNORECASE
+    ),
+    re.compile(
+        rb'(<input\s(?=[^>]*name="authenticity_token")[^>]*value=")[^"]*(")',
+        re.IGNORECASE,
+    ),
+]
+
+# Headers describing the wire encoding, which no longer apply to the stored body
+WIRE_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+def _encode_body(body):
+    """Return a JSON-friendly representation of a request or response body."""
+    if body is None:
+        return None
+    if isinstance(body, str):
+        return {"text": body}
+    try:
+        return {"text": body.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"base64": base64.b64encode(body).decode("ascii")}
+
+
+def _decode_body(body):
+    """Inverse of _encode_body, always returning bytes (or None)."""
+    if body is None:
+        return None
+    if "text" in body:
+        return body["text"].encode("utf-8")
+    return base64.b64decode(body["base64"])
+
+
+def _scrub_headers(headers):
+    return {
+        key: SCRUBBED if key.lower() in SECRET_HEADERS else value
+        for key, value in headers.items()
+    }
+
+
+def _scrub_form(body):
+    """Scrub secret fields from an urlencoded form body."""
+    if body is None:
+        return None
+    if isinstance(body, bytes):
+        try:
+            body = body.decode("utf-8")
+        except UnicodeDecodeError:
+            return body
+    if not isinstance(body, str) or "=" not in body:
+        return body
+    fields = urllib.parse.parse_qsl(body, keep_blank_values=True)
+    fields = [
+        (name, SCRUBBED if name in SECRET_FIELDS else value) for name, value in fields
+    ]
+    return urllib.parse.urlencode(fields)
+
+
+def _scrub_page(content):
+    """Scrub the CSRF tokens of a response body."""
+    for pattern in SECRET_BODY_PATTERNS:
+        content = pattern.sub(rb"\1" + SCRUBBED_TOKEN + rb"\2", content)
+    return content
+
+
+def _request_key(method, url):
+    """Key used to match a replayed request with a recorded one."""
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+        path = f"{path}?{parts.query}"
+    return f"{method.upper()} {path}"
+
+
+class CassetteWriter:
+    """Append-only, thread-safe writer for a cassette file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+
+    def write(self, exchange):
+        with self._lock:
+            self._file.write(json.dumps(exchange, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class CassetteRecorder(BaseAdapter):
+    """Transport adapter forwarding requests and recording every exchange."""
+
+    def __init__(self, writer, inner=None):
+        super().__init__()
+        self.writer = writer
+        self.inner = inner or HTTPAdapter()
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        response = self.inner.send(request, **kwargs)
+        # Reading the content here also releases the connection to the pool
+        content = response.content
+        elapsed = time.perf_counter() - start
+
+        exchange = {
+            "key": _request_key(request.method, request.url),
+            "request": {
+                "method": request.method,
+                "url": request.url,
+                "headers": _scrub_headers(request.headers),
+                "body": _encode_body(_scrub_form(request.body)),
+            },
+            "response": {
+                "status": response.status_code,
+                "reason": response.reason,
+                "url": response.url,
+                "headers": {
+                    key: value
+                    for key, value in _scrub_headers(response.headers).items()
+                    if key.lower() not in WIRE_HEADERS
+                },
+                "body": _encode_body(_scrub_page(content)),
+            },
+            "elapsed": round(elapsed, 4),
+        }
+        self.writer.write(exchange)
+        logger.debug(f"Recorded {exchange['key']} ({response.status_code})")
+        return response
+
+    def close(self):
+        self.writer.close()
+        self.inner.close()
+
+
+class CassettePlayer(BaseAdapter):
+    """Transport adapter answering requests from a recorded cassette.
+
+    Exchanges are matched on method and path (query string included), in the
+    order they were recorded. ``speed`` scales the recorded latencies: 1.0
+    replays in real time, 2.0 twice as fast, and 0 without any delay.
+    """
+
+    def __init__(self, path, speed=0.0):
+        super().__init__()
+        self.path = path
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._exchanges = defaultdict(deque)
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    exchange = json.loads(line)
+                    self._exchanges[exchange["key"]].append(exchange)
+        logger.info(
+            f"Loaded {sum(len(q) for q in self._exchanges.values())} exchanges from {path}"
+        )
+
+    def remaining(self):
+        """Number of recorded exchanges not replayed yet."""
+        with self._lock:
+            return sum(len(q) for q in self._exchanges.values())
+
+    def send(self, request, **kwargs):
+        key = _request_key(request.method, request.url)
+        with self._lock:
+            queue = self._exchanges.get(key)
+            exchange = queue.popleft() if queue else None
+        if exchange is None:
+            raise requests.exceptions.ConnectionError(
+                f"No recorded exchange for {key} in {self.path}", request=request
+            )
+
+        if self.speed:
+            time.sleep(exchange["elapsed"] / self.speed)
+
+        recorded = exchange["response"]
+        content = _decode_body(recorded["body"]) or b""
+        response = requests.Response()
+        response.status_code = recorded["status"]
+        response.reason = recorded["reason"]
+        response.headers = CaseInsensitiveDict(recorded["headers"])
+        response.url = request.url
+        response.request = request
+        response.raw = io.BytesIO(content)
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response._content = content
+        response._content_consumed = True
+        logger.debug(f"Replayed {key} ({response.status_code})")
+        return response
+
+    def close(self):
+        pass
+
+
+def attach(session, path, mode="replay", speed=0.0, prefixes=("https://", "http://")):
+    """Mount a cassette recorder or player on a requests session.
+
+    In ``record`` mode the adapter currently mounted on the session keeps
+    doing the actual work, so other transport layers stay in effect.
+    """
+    if mode == "record":
+        writer = CassetteWriter(path)
+        for prefix in prefixes:
+            session.mount(prefix, CassetteRecorder(writer, session.adapters[prefix]))
+    elif mode == "replay":
+        player = CassettePlayer(path, speed=speed)
+        for prefix in prefixes:
+            session.mount(prefix, player)
+    else:
+        raise ValueError(f"Unknown cassette mode: {mode}")
@@ -0,0 +1,55 @@
+import gzip
+import io
+import lzma
+import os
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency, installed with the "zstd" extra
+    zstandard = None
+
+# Transparent reading of compressed inputs: the member and candidature exports,
+# voters and candidates files can be kept as .gz, .xz or .zst files, which are
+# decompressed in a stream while being read, without temporary files.
+
+COMPRESSED_SUFFIXES = (".gz", ".xz", ".zst")
+
+
+def strip_compression_suffix(path):
+    """Path without its compression suffix, like voters.txt for voters.txt.gz."""
+    path = os.fspath(path)
+    for suffix in COMPRESSED_SUFFIXES:
+        if path.endswith(suffix):
+            return path[: -len(suffix)]
+    return path
+
+
+def _open_zstd(path):
+    if zstandard is None:
+        raise RuntimeError(
+            f"The zstandard package is required to read {path}, install it with "
+            "`poetry install --extras zstd`"
+        )
+    return zstandard.ZstdDecompressor().stream_reader(
+        open(path, "rb"), read_across_frames=True, closefd=True
+    )
+
+
+def open_input(path, mode="r", encoding="utf-8", newline=None):
+    """Open a file for reading like open(), decompressing it if compressed."""
+    path = os.fspath(path)
+    binary = "b" in mode
+    if path.endswith(".gz"):
+        raw = gzip.open(path, "rb")
+    elif path.endswith(".xz"):
+        raw = lzma.open(path, "rb")
+    elif path.endswith(".zst"):
+        raw = _open_zstd(path)
+    elif binary:
+        return open(path, "rb")
+    else:
+        return open(path, "r", encoding=encoding, newline=newline)
+
+    if binary:
+        return raw
+    return io.TextIOWrapper(raw, encoding=encoding, newline=newline)
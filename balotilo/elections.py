@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+
+import yaml
+
+try:
+    from compression import strip_compression_suffix
+except ImportError:  # Imported by the preprocessing scripts from the repository root
+    from balotilo.compression import strip_compression_suffix
+
+# Helpers to read an elections directory: a config.yaml shared by all elections,
+# and one subdirectory per election with its voters and candidates files.
+
+logger = logging.getLogger(__name__)
+
+# Election directory name -> owning account and election ID on Balotilo
+MAPPING_FILE = "election_accounts.json"
+
+
+def load_config(elections_dir):
+    """Load the config.yaml shared by all the elections of a directory."""
+    config_file = os.path.join(elections_dir, "config.yaml")
+    if not os.path.exists(config_file):
+        logger.error(
+            f"Directory '{elections_dir}' does not contain yaml configuration file."
+        )
+        return None
+
+    with open(config_file, "r") as f:
+        return yaml.safe_load(f)
+
+
+def list_election_dirs(elections_dir):
+    """List the election subdirectories of an elections directory."""
+    return [
+        os.path.join(elections_dir, dir_name)
+        for dir_name in sorted(os.listdir(elections_dir))
+        if os.path.isdir(os.path.join(elections_dir, dir_name))
+    ]
+
+
+def _pick_file(dir_path, paths, kind):
+    """The uncompressed file among the candidate files of a kind, if any."""
+    if not paths:
+        return None
+    plain = [path for path in paths if strip_compression_suffix(path) == path]
+    chosen = (plain or paths)[0]
+    if len(paths) > 1:
+        logger.warning(
+            f"Several {kind} files in {dir_path}: "
+            f"{', '.join(os.path.basename(path) for path in paths)}, "
+            f"using {os.path.basename(chosen)}"
+        )
+    return chosen
+
+
+def find_election_files(dir_path):
+    """Find the voters and candidates files of an election directory.
+
+    The files may be compressed, like voters.txt.gz. When both voters.txt and
+    voters.txt.gz are present, the uncompressed file is used.
+    """
+    voters_files = []
+    candidates_files = []
+
+    for file_name in sorted(os.listdir(dir_path)):
+        file_path = os.path.join(dir_path, file_name)
+        file_name = strip_compression_suffix(file_name)
+
+        if file_name.endswith(".yaml") or file_name.endswith(".yml"):
+            candidates_files.append(file_path)
+        elif "voters" in file_name.lower() and file_name.endswith(".txt"):
+            voters_files.append(file_path)
+
+    return (
+        _pick_file(dir_path, voters_files, "voters"),
+        _pick_file(dir_path, candidates_files, "candidates"),
+    )
+
+
+def load_mapping(elections_dir):
+    """Mapping of election directory name to its owning account and election ID."""
+    mapping_file = os.path.join(elections_dir, MAPPING_FILE)
+    if not os.path.exists(mapping_file):
+        return {}
+    with open(mapping_file, "r") as f:
+        return json.load(f)
+
+
+def save_mapping(elections_dir, mapping):
+    mapping_file = os.path.join(elections_dir, MAPPING_FILE)
+    tmp_file = f"{mapping_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(mapping, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, mapping_file)
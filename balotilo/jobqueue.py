@@ -0,0 +1,440 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+import scheduler
+from elections import list_election_dirs, load_config, load_mapping, save_mapping
+from main import ROOT_DIR, BalotiloAutomation
+
+# SQLite-backed job queue to spread the creation of many elections over several
+# worker processes. A planner enqueues one job per election directory, workers
+# claim jobs under a lease they keep alive with heartbeats, and jobs whose lease
+# expired (crashed or stuck worker) are claimed again by another worker.
+# Jobs are claimed by decreasing predicted duration, which balances the load
+# between workers (longest-processing-time-first).
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    election_dir TEXT NOT NULL UNIQUE,
+    priority REAL NOT NULL DEFAULT 0,
+    features TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    next_run_at REAL NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    duration REAL,
+    account TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority, id);
+CREATE TABLE IF NOT EXISTS orphans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id INTEGER NOT NULL,
+    election_id TEXT NOT NULL,
+    worker_id TEXT NOT NULL,
+    account TEXT,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class JobQueue:
+    """Durable queue of election jobs stored in a SQLite database."""
+
+    def __init__(self, db_path, lease_seconds=120, max_attempts=5, backoff_seconds=30):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        # Queues created before the account column was added
+        columns = [row["name"] for row in self.conn.execute("PRAGMA table_info(jobs)")]
+        if "account" not in columns:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN account TEXT")
+
+    def enqueue(self, election_dir, priority=0, features=None):
+        """Add a job for an election directory, unless it is already queued."""
+        now = time.time()
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO jobs "
+            "(election_dir, priority, features, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (election_dir, priority, json.dumps(features), now, now),
+        )
+        return cursor.rowcount == 1
+
+    def claim(self, worker_id):
+        """Lease the next runnable job to a worker, or return None."""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Jobs of crashed workers whose attempts are exhausted are given up
+            self.conn.execute(
+                "UPDATE jobs SET status = 'failed', lease_owner = NULL, "
+                "error = COALESCE(error, 'lease expired'), updated_at = ? "
+                "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            row = self.conn.execute(
+                "SELECT id FROM jobs "
+                "WHERE (status = 'pending' AND next_run_at <= ?) "
+                "OR (status = 'running' AND lease_expires < ?) "
+                "ORDER BY priority DESC, id LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+            self.conn.execute(
+                "UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (worker_id, now + self.lease_seconds, now, row["id"]),
+            )
+            job = self.conn.execute(
+                "SELECT * FROM jobs WHERE id = ?", (row["id"],)
+            ).fetchone()
+            self.conn.execute("COMMIT")
+            return dict(job)
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def heartbeat(self, job_id, worker_id):
+        """Extend the lease of a job. Returns False if the lease was lost."""
+        now = time.time()
+        cursor = self.conn.execute(
+            "UPDATE jobs SET lease_expires = ?, updated_at = ? "
+            "WHERE id = ? AND lease_owner = ? AND status = 'running'",
+            (now + self.lease_seconds, now, job_id, worker_id),
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker_id, result, duration=None, account=None):
+        """Mark a job as done and record its result and the account it used.
+
+        A worker which lost its lease still completes the job unless another
+        worker already did, as its election was created anyway. Otherwise its
+        election is a duplicate: it is recorded as orphaned, to be deleted, and
+        False is returned.
+        """
+        now = time.time()
+        cursor = self.conn.execute(
+            "UPDATE jobs SET status = 'done', result = ?, duration = ?, account = ?, "
+            "error = NULL, lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE id = ? AND (lease_owner = ? OR status != 'done')",
+            (result, duration, account, now, job_id, worker_id),
+        )
+        if cursor.rowcount == 1:
+            return True
+        self.conn.execute(
+            "INSERT INTO orphans (job_id, election_id, worker_id, account, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (job_id, result, worker_id, account, now),
+        )
+        logger.error(
+            f"Job {job_id} was already done by another worker, "
+            f"election {result} of {account} is a duplicate"
+        )
+        return False
+
+    def fail(self, job_id, worker_id, error):
+        """Schedule a retry with exponential backoff, or give up on the job."""
+        now = time.time()
+        job = self.conn.execute(
+            "SELECT attempts FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if job["attempts"] >= self.max_attempts:
+            status, next_run_at = "failed", now
+        else:
+            status = "pending"
+            next_run_at = now + self.backoff_seconds * 2 ** (job["attempts"] - 1)
+        self.conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, next_run_at = ?, "
+            "lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE id = ? AND lease_owner = ?",
+            (status, error, next_run_at, now, job_id, worker_id),
+        )
+
+    def is_drained(self):
+        """True when no job is pending or running anymore."""
+        row = self.conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')"
+        ).fetchone()
+        return row[0] == 0
+
+    def stats(self):
+        """Number of jobs per status."""
+        rows = self.conn.execute(
+            "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+        ).fetchall()
+        return {status: count for status, count in rows}
+
+    def jobs(self):
+        return [
+            dict(row) for row in self.conn.execute("SELECT * FROM jobs ORDER BY id")
+        ]
+
+    def orphans(self):
+        """Duplicate elections created by workers which lost their job lease."""
+        return [
+            dict(row)
+            for row in self.conn.execute(
+                "SELECT orphans.*, jobs.election_dir FROM orphans "
+                "JOIN jobs ON jobs.id = orphans.job_id ORDER BY orphans.id"
+            )
+        ]
+
+    def close(self):
+        self.conn.close()
+
+
+def plan(queue, elections_dir="elections/"):
+    """Enqueue one job per election directory, prioritized by predicted duration."""
+    elections_dir = os.path.join(ROOT_DIR, elections_dir)
+    estimates = scheduler.CostModel(elections_dir).estimate(
+        list_election_dirs(elections_dir)
+    )
+    added = 0
+    for dir_path in scheduler.largest_first(estimates):
+        estimate = estimates[dir_path]
+        if queue.enqueue(
+            os.path.abspath(dir_path), estimate["predicted"], estimate["features"]
+        ):
+            added += 1
+    logger.info(f"Enqueued {added} new election jobs")
+    return added
+
+
+def save_results(queue, username=None):
+    """Record the created elections and feed their durations to the cost models.
+
+    Elections are mapped to the account of the worker which created them, or to
+    username for jobs completed before the account was recorded.
+    """
+    models = {}
+    mappings = {}
+    for job in queue.jobs():
+        if job["status"] != "done":
+            continue
+        elections_dir = os.path.dirname(job["election_dir"])
+        if elections_dir not in models:
+            models[elections_dir] = scheduler.CostModel(elections_dir)
+            mappings[elections_dir] = load_mapping(elections_dir)
+        mappings[elections_dir][os.path.basename(job["election_dir"])] = {
+            "account": job["account"] or username,
+            "election_id": job["result"],
+        }
+        if job["duration"] is not None:
+            models[elections_dir].record(
+                job["election_dir"],
+                json.loads(job["features"]),
+                job["priority"],
+                job["duration"],
+            )
+    for elections_dir, model in models.items():
+        model.save()
+        save_mapping(elections_dir, mappings[elections_dir])
+
+
+class Worker:
+    """Claims election jobs from the queue and processes them one by one."""
+
+    def __init__(self, queue, automation, worker_id=None, poll_interval=5):
+        self.queue = queue
+        self.automation = automation
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.poll_interval = poll_interval
+        self._configs = {}
+
+    def _config_for(self, dir_path):
+        elections_dir = os.path.dirname(dir_path)
+        if elections_dir not in self._configs:
+            self._configs[elections_dir] = load_config(elections_dir)
+        return self._configs[elections_dir]
+
+    def _keep_lease(self, job_id, stop):
+        # A separate connection, as sqlite3 connections are not shared across threads
+        queue = JobQueue(self.queue.db_path, lease_seconds=self.queue.lease_seconds)
+        try:
+            while not stop.wait(self.queue.lease_seconds / 3):
+                if not queue.heartbeat(job_id, self.worker_id):
+                    logger.warning(
+                        f"Worker {self.worker_id} lost lease on job {job_id}"
+                    )
+                    return
+        finally:
+            queue.close()
+
+    def process(self, job):
+        """Process a single claimed job, keeping its lease alive meanwhile."""
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._keep_lease, args=(job["id"], stop), daemon=True
+        )
+        heartbeat.start()
+        try:
+            config = self._config_for(job["election_dir"])
+            if config is None:
+                raise RuntimeError("Missing config.yaml")
+            start = time.perf_counter()
+            election_id = self.automation.process_election(config, job["election_dir"])
+            if not election_id:
+                raise RuntimeError("Election creation failed")
+            duration = time.perf_counter() - start
+            if self.queue.complete(
+                job["id"],
+                self.worker_id,
+                election_id,
+                duration,
+                self.automation.username,
+            ):
+                logger.info(f"Job {job['id']} done: election {election_id}")
+        except Exception as e:
+            logger.error(f"Job {job['id']} failed: {str(e)}")
+            self.queue.fail(job["id"], self.worker_id, str(e))
+        finally:
+            stop.set()
+            heartbeat.join()
+
+    def run(self):
+        """Process jobs until the queue is drained."""
+        if not self.automation.login():
+            return
+        logger.info(f"Worker {self.worker_id} started")
+        while True:
+            job = self.queue.claim(self.worker_id)
+            if job is None:
+                if self.queue.is_drained():
+                    break
+                time.sleep(self.poll_interval)
+                continue
+
+            logger.info(
+                f"Worker {self.worker_id} claimed job {job['id']} "
+                f"({os.path.basename(job['election_dir'])}, attempt {job['attempts']})"
+            )
+            self.process(job)
+
+            # Wait a bit before processing the next election to avoid rate limiting
+            time.sleep(2)
+        logger.info(f"Worker {self.worker_id} finished")
+
+
+def run_worker(db_path, username, password, lease_seconds=120, max_attempts=5):
+    """Entry point of a worker process, with its own queue connection and login."""
+    queue = JobQueue(db_path, lease_seconds=lease_seconds, max_attempts=max_attempts)
+    try:
+        Worker(queue, BalotiloAutomation(username, password)).run()
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Create Balotilo elections through a multi-process job queue"
+    )
+    parser.add_argument(
+        "--db",
+        default="balotilo_jobs.sqlite",
+        help="SQLite database holding the jobs (default: balotilo_jobs.sqlite)",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    plan_parser = subparsers.add_parser("plan", help="Enqueue one job per election")
+    plan_parser.add_argument(
+        "--elections-dir",
+        default="elections/",
+        help="Directory containing election data (default: elections/)",
+    )
+
+    work_parser = subparsers.add_parser("work", help="Run worker processes")
+    work_parser.add_argument("username", help="Your Balotilo username (email)")
+    work_parser.add_argument("password", help="Your Balotilo password")
+    work_parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes (default: 1)"
+    )
+    work_parser.add_argument(
+        "--lease-seconds",
+        type=int,
+        default=120,
+        help="Lease duration before a silent worker's job is reclaimed (default: 120)",
+    )
+    work_parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=5,
+        help="Attempts before a job is marked as failed (default: 5)",
+    )
+
+    subparsers.add_parser("status", help="Show the state of the jobs")
+
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        queue = JobQueue(args.db)
+        plan(queue, args.elections_dir)
+        queue.close()
+    elif args.command == "work":
+        processes = [
+            multiprocessing.Process(
+                target=run_worker,
+                args=(
+                    args.db,
+                    args.username,
+                    args.password,
+                    args.lease_seconds,
+                    args.max_attempts,
+                ),
+            )
+            for _ in range(args.workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        queue = JobQueue(args.db)
+        save_results(queue, args.username)
+        queue.close()
+    elif args.command == "status":
+        queue = JobQueue(args.db)
+        for job in queue.jobs():
+            print(
+                f"{job['status']:8} {os.path.basename(job['election_dir']):30} "
+                f"attempts={job['attempts']} result={job['result'] or ''} "
+                f"{job['error'] or ''}"
+            )
+        print(queue.stats())
+        for orphan in queue.orphans():
+            print(
+                f"orphaned {os.path.basename(orphan['election_dir']):30} "
+                f"election={orphan['election_id']} account={orphan['account'] or ''} "
+                f"worker={orphan['worker_id']}"
+            )
+        scheduler.report(
+            [
+                (
+                    os.path.basename(job["election_dir"]),
+                    job["priority"],
+                    job["duration"],
+                )
+                for job in queue.jobs()
+            ]
+        )
+        queue.close()
@@ -2,12 +2,26 @@ import argparse
 import json
 import logging
 import os
+import re
 import time
+import urllib.parse
 
 import requests
-import yaml
 from bs4 import BeautifulSoup
 
+import bundle
+import cassette
+from compression import open_input
+from profiling import profiler
+import scheduler
+import transport
+from elections import (
+    list_election_dirs,
+    load_config,
+    load_mapping,
+    save_mapping,
+)
+
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 print(ROOT_DIR)
 
@@ -19,30 +33,92 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Patterns looked for in streamed responses, so that reading can stop early
+CSRF_META_PATTERN = re.compile(
+    rb'<meta\s(?=[^>]*name="csrf-token")[^>]*content="([^"]*)"', re.IGNORECASE
+)
+LOGGED_IN_PATTERN = re.compile(rb"My elections|Create an election")
+TITLE_PATTERN = re.compile(rb"<title>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+LOGIN_FORM_PATTERN = re.compile(
+    rb"<form[^>]*new_user_session.*?</form>", re.IGNORECASE | re.DOTALL
+)
+CONSULTATION_FORM_PATTERN = re.compile(
+    rb'<form[^>]*id="new_consultation".*?</form>', re.IGNORECASE | re.DOTALL
+)
+
+# Bytes left in a response body under which it is drained rather than closed,
+# as draining keeps the connection alive for the next request
+DRAIN_LIMIT = 64 * 1024
+
+
+def read_until(response, pattern, max_bytes=2 * 1024 * 1024, chunk_size=8192):
+    """Read a streamed response until pattern matches, then release the connection.
+
+    Returns the match (or None) and the bytes read so far.
+    """
+    buffer = b""
+    match = None
+    try:
+        for chunk in response.iter_content(chunk_size):
+            buffer += chunk
+            match = pattern.search(buffer)
+            if match or len(buffer) >= max_bytes:
+                break
+    finally:
+        release(response)
+    return match, buffer
+
+
+def release(response):
+    """Give the connection of a streamed response back to the pool."""
+    raw = response.raw
+    if not response._content_consumed and hasattr(raw, "drain_conn"):
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) - raw.tell() <= DRAIN_LIMIT:
+            raw.drain_conn()
+    response.close()
+
+
+def text(data):
+    return data.decode("utf-8", errors="replace")
+
 
 class BalotiloAutomation:
-    def __init__(self, username, password, base_url="https://www.balotilo.org"):
+    def __init__(
+        self,
+        username,
+        password,
+        base_url="https://www.balotilo.org",
+        transport_config=None,
+    ):
         self.username = username
         self.password = password
         self.base_url = base_url
         self.session = requests.Session()
+        self.transport = transport.attach(self.session, transport_config)
+        self.election_deadline = self.transport.settings["election_deadline"]
         self.session.headers.update(
             {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+                "Accept-Encoding": requests.utils.DEFAULT_ACCEPT_ENCODING,
             }
         )
 
+    @profiler.profiled("login")
     def login(self):
         """Login to Balotilo with the provided credentials."""
         try:
             # First visit the home page to get initial cookies and CSRF token
             logger.info(f"Visiting home page to get initial cookies and CSRF token")
-            home_response = self.session.get(self.base_url)
+            home_response = self.session.get(self.base_url, stream=True)
             home_response.raise_for_status()
 
-            # Parse home page to get CSRF token
-            home_soup = BeautifulSoup(home_response.text, "html.parser")
-            csrf_token = home_soup.find("meta", {"name": "csrf-token"})["content"]
+            # Read the home page only up to its CSRF token
+            match, _ = read_until(home_response, CSRF_META_PATTERN)
+            if not match:
+                logger.error("Could not find CSRF token on home page")
+                return False
+            csrf_token = text(match.group(1))
             logger.debug(f"CSRF token from home page: {csrf_token}")
             logger.debug(f"Cookies after home page: {dict(self.session.cookies)}")
 
@@ -66,7 +142,10 @@ class BalotiloAutomation:
                 data=locale_data,
                 headers=locale_headers,
                 allow_redirects=True,
+                stream=True,
             )
+            # Only the cookies matter, not the page we get redirected to
+            release(locale_response)
 
             logger.debug(f"Locale response status: {locale_response.status_code}")
             logger.debug(f"Locale response URL: {locale_response.url}")
@@ -75,11 +154,15 @@ class BalotiloAutomation:
             # Now get the login page (which should be in English)
             login_url = f"{self.base_url}/login"
             logger.info(f"Getting login page: {login_url}")
-            response = self.session.get(login_url)
+            response = self.session.get(login_url, stream=True)
             response.raise_for_status()
 
+            # Read the login page only up to the end of the login form
+            match, page = read_until(response, LOGIN_FORM_PATTERN)
+            page = text(page)
+
             # Verify we got an English page
-            if "Log in" in response.text:
+            if "Log in" in page:
                 logger.info("Successfully got English login page")
             else:
                 logger.warning("Login page might not be in English")
@@ -87,16 +170,16 @@ class BalotiloAutomation:
             # Dump response details
             logger.debug(f"Login page status code: {response.status_code}")
             logger.debug(f"Login page URL: {response.url}")
-            logger.debug(f"First 200 chars of login page: {response.text[:200]}")
+            logger.debug(f"First 200 chars of login page: {page[:200]}")
 
-            # Parse the login page to extract the form
-            soup = BeautifulSoup(response.text, "html.parser")
+            # Parse the login form
+            soup = BeautifulSoup(text(match.group(0)) if match else "", "html.parser")
 
             # Find the login form
             login_form = soup.find("form", {"class": "new_user_session"})
             if not login_form:
                 logger.error("Could not find the login form")
-                logger.debug(f"Page content: {response.text}")
+                logger.debug(f"Page content: {page}")
                 return False
 
             # Extract the form action URL
@@ -167,33 +250,38 @@ class BalotiloAutomation:
             logger.debug(f"Form data: {form_data}")
 
             response = self.session.post(
-                form_action, data=encoded_data, headers=headers, allow_redirects=True
+                form_action,
+                data=encoded_data,
+                headers=headers,
+                allow_redirects=True,
+                stream=True,
             )
+            match, page = read_until(response, LOGGED_IN_PATTERN)
 
             # Detailed logging of the response
             logger.debug(f"Login response status: {response.status_code}")
             logger.debug(f"Login response URL: {response.url}")
-            logger.debug(f"First 500 chars of response: {response.text[:500]}")
+            logger.debug(f"First 500 chars of response: {text(page[:500])}")
 
             # Check if login was successful
-            if "My elections" in response.text or "Create an election" in response.text:
+            if match:
                 logger.info("Login successful!")
                 return True
             else:
                 # Try to get the consultations page to see if we're actually logged in
-                consult_response = self.session.get(f"{self.base_url}/consultations")
+                consult_response = self.session.get(
+                    f"{self.base_url}/consultations", stream=True
+                )
+                match, page = read_until(consult_response, LOGGED_IN_PATTERN)
                 logger.debug(
                     f"Consultation page status: {consult_response.status_code}"
                 )
                 logger.debug(f"Consultation page URL: {consult_response.url}")
                 logger.debug(
-                    f"First 500 chars of consultations page: {consult_response.text[:500]}"
+                    f"First 500 chars of consultations page: {text(page[:500])}"
                 )
 
-                if (
-                    "My elections" in consult_response.text
-                    or "Create an election" in consult_response.text
-                ):
+                if match:
                     logger.info("Login was actually successful!")
                     return True
 
@@ -204,31 +292,28 @@ class BalotiloAutomation:
             logger.exception("Exception details:")
             return False
 
-    def create_election(self, config, voters_file, candidates_file):
-        """Create a new election on Balotilo with candidates lists."""
+    def create_election(self, config, voters, candidates_data):
+        """Create a new election on Balotilo with candidates lists and voters."""
         try:
             # Navigate to the create election page
             create_url = f"{self.base_url}/consultations/new"
             logger.info(f"Navigating to create election page: {create_url}")
-            response = self.session.get(create_url)
-            response.raise_for_status()
+            page, create_form = self._fetch_create_form(create_url)
 
             # First, verify we're on the create page
-            if "New election" not in response.text:
+            if b"New election" not in page:
                 logger.error("Not on the create election page")
+                title = TITLE_PATTERN.search(page)
                 logger.debug(
-                    f"Page title: {BeautifulSoup(response.text, 'html.parser').find('title').text if BeautifulSoup(response.text, 'html.parser').find('title') else 'No title found'}"
+                    f"Page title: {text(title.group(1)) if title else 'No title found'}"
                 )
                 # Try to re-login if needed
-                if "Log in" in response.text:
+                if b"Log in" in page:
                     logger.info("Need to log in again")
                     if not self.login():
                         return None
-                    response = self.session.get(create_url)
-                    response.raise_for_status()
+                    page, create_form = self._fetch_create_form(create_url)
 
-            soup = BeautifulSoup(response.text, "html.parser")
-            create_form = soup.find("form", {"id": "new_consultation"})
             if not create_form:
                 logger.error("Could not find the new_consultation form")
                 return None
@@ -249,10 +334,6 @@ class BalotiloAutomation:
             ]
             logger.info(f"Using CSRF token from form: {csrf_token[:10]}...")
 
-            # Load candidates from YAML file
-            with open(candidates_file, "r") as f:
-                candidates_data = yaml.safe_load(f)
-
             # Make a request to add a list voting question and get the question ID
             logger.info("Requesting list voting question template")
             headers = {
@@ -308,27 +389,10 @@ class BalotiloAutomation:
             list_ids = []
             for list_title in candidates_data.keys():
                 logger.info(f"Requesting template for list: {list_title}")
-                list_response = self.session.get(
-                    f"{self.base_url}/consultations/add_list?lists_id={lists_id}&question_index={question_id}",
-                    headers=headers,
-                )
-                list_response.raise_for_status()
-
-                list_soup = BeautifulSoup(list_response.text, "html.parser")
-
-                # Find the list ID from the form fields
-                list_id = None
-                input_fields = list_soup.find_all("input")
-                for field in input_fields:
-                    name = field.get("name", "")
-                    if "list_voting_new_lists" in name and "_destroy" in name:
-                        # Extract the ID from the name attribute
-                        list_id = name.split("[")[4].split("]")[0]
-                        logger.info(f"Extracted list ID: {list_id}")
-                        list_ids.append(list_id)
-                        break
-
-                if not list_id:
+                list_id = self._request_list_id(lists_id, question_id, headers)
+                if list_id:
+                    list_ids.append(list_id)
+                else:
                     logger.warning(f"Could not extract list ID for list: {list_title}")
 
             # Prepare form data very carefully to match exactly what the browser would send
@@ -450,12 +514,14 @@ class BalotiloAutomation:
 
             # Submit the form with debug mode - DON'T follow redirects so we can see the response
             logger.info("Submitting election creation form")
-            response = self.session.post(
-                f"{self.base_url}/consultations",
-                data=form_data,
-                headers=post_headers,
-                allow_redirects=False,  # Important! Don't follow redirects to see the response
-            )
+            with profiler.phase("submit"):
+                response = self.session.post(
+                    f"{self.base_url}/consultations",
+                    data=form_data,
+                    headers=post_headers,
+                    allow_redirects=False,  # Important! Don't follow redirects to see the response
+                    stream=True,
+                )
 
             # Log the immediate response
             logger.debug(f"Form submission status code: {response.status_code}")
@@ -463,37 +529,39 @@ class BalotiloAutomation:
 
             # If we got a redirect, that's probably good
             if response.status_code in (301, 302, 303):
-                redirect_url = response.headers.get("Location")
+                # The redirect body is of no use, only its Location header
+                release(response)
+                redirect_url = response.headers.get("Location") or ""
                 logger.info(f"Got redirect to: {redirect_url}")
 
+                # A redirect to edit_new_voters means the election was created
+                if "/edit_new_voters" in redirect_url:
+                    election_id = urllib.parse.urlsplit(redirect_url).path.split("/")[2]
+                    logger.info(f"Election created with ID: {election_id}")
+                    # The election exists from now on, so nothing below may make
+                    # the creation fail, which would create it again on retry.
+                    # A failed import is logged, and fixed by syncing the voters.
+                    self._import_voters(election_id, "\n".join(voters))
+                    return election_id
+
                 # Follow the redirect manually to debug
                 redirect_response = self.session.get(
-                    redirect_url
-                    if redirect_url.startswith("http")
-                    else f"{self.base_url}{redirect_url}"
+                    (
+                        redirect_url
+                        if redirect_url.startswith("http")
+                        else f"{self.base_url}{redirect_url}"
+                    ),
+                    stream=True,
                 )
+                title, _ = read_until(redirect_response, TITLE_PATTERN)
 
                 logger.debug(
                     f"Redirect response status: {redirect_response.status_code}"
                 )
                 logger.debug(
-                    f"Redirect page title: {BeautifulSoup(redirect_response.text, 'html.parser').find('title').text if BeautifulSoup(redirect_response.text, 'html.parser').find('title') else 'No title'}"
+                    f"Redirect page title: {text(title.group(1)) if title else 'No title'}"
                 )
 
-                # Check if we got redirected to an edit_new_voters page
-                if "/edit_new_voters" in redirect_url:
-                    # Success! The election was created
-                    election_id = (
-                        redirect_url.split("/")[2]
-                        if redirect_url.startswith("/")
-                        else redirect_url.split("/")[4]
-                    )
-                    logger.info(f"Election created with ID: {election_id}")
-
-                    # Add voters
-                    self._add_voters(election_id, voters_file)
-                    return election_id
-
             # If we're here, something went wrong
             # Check for error messages in the response
             error_soup = BeautifulSoup(response.text, "html.parser")
@@ -516,20 +584,69 @@ class BalotiloAutomation:
             logger.exception("Traceback:")
             return None
 
+    @profiler.profiled("form fetch")
+    def _fetch_create_form(self, create_url):
+        """Get the election creation page and its form, if found."""
+        response = self.session.get(create_url, stream=True)
+        response.raise_for_status()
+        # Read the page only up to the end of the creation form
+        match, page = read_until(response, CONSULTATION_FORM_PATTERN)
+
+        soup = BeautifulSoup(text(match.group(0)) if match else "", "html.parser")
+        return page, soup.find("form", {"id": "new_consultation"})
+
+    @profiler.profiled("list templates")
+    def _request_list_id(self, lists_id, question_id, headers):
+        """Request a new list template for a question and return its list ID."""
+        list_response = self.session.get(
+            f"{self.base_url}/consultations/add_list?lists_id={lists_id}&question_index={question_id}",
+            headers=headers,
+        )
+        list_response.raise_for_status()
+
+        list_soup = BeautifulSoup(list_response.text, "html.parser")
+
+        # Find the list ID from the form fields
+        input_fields = list_soup.find_all("input")
+        for field in input_fields:
+            name = field.get("name", "")
+            if "list_voting_new_lists" in name and "_destroy" in name:
+                # Extract the ID from the name attribute
+                list_id = name.split("[")[4].split("]")[0]
+                logger.info(f"Extracted list ID: {list_id}")
+                return list_id
+
+        return None
+
     def _add_voters(self, election_id, voters_file):
         """Add voters to the election from a file."""
+        try:
+            # Read the voters emails from the file
+            with open_input(voters_file) as f:
+                voters_emails = f.read().strip()
+        except OSError as e:
+            logger.error(f"Error reading voters file {voters_file}: {str(e)}")
+            return False
+
+        return self._import_voters(election_id, voters_emails)
+
+    @profiler.profiled("voter import")
+    def _import_voters(self, election_id, voters_emails):
+        """Add voters to the election, given one email per line."""
         try:
             # First get a CSRF token from the consultations page
             logger.info(f"Getting CSRF token for election {election_id}")
-            response = self.session.get(f"{self.base_url}/consultations/{election_id}")
+            response = self.session.get(
+                f"{self.base_url}/consultations/{election_id}", stream=True
+            )
             response.raise_for_status()
 
-            soup = BeautifulSoup(response.text, "html.parser")
-            csrf_token = soup.find("meta", {"name": "csrf-token"})["content"]
-
-            # Read the voters emails from the file
-            with open(voters_file, "r") as f:
-                voters_emails = f.read().strip()
+            # Read the page only up to its CSRF token
+            match, _ = read_until(response, CSRF_META_PATTERN)
+            if not match:
+                logger.error(f"Could not find CSRF token for election {election_id}")
+                return False
+            csrf_token = text(match.group(1))
 
             # Count how many voters we're importing
             email_count = voters_emails.count("@")
@@ -558,30 +675,68 @@ class BalotiloAutomation:
             )
 
             response = self.session.post(
-                import_url, data=import_data, headers=headers, allow_redirects=False
+                import_url,
+                data=import_data,
+                headers=headers,
+                allow_redirects=False,
+                stream=True,
             )
             response.raise_for_status()
 
-            print(response.status_code)
-            print(response.url)
-
-            # Check if we were redirected to the consultations page (success)
-            if "/consultations" in response.url and not response.url.endswith(
-                f"{election_id}/edit_new_voters"
-            ):
-                logger.info(f"Successfully imported {email_count} voters")
-                return True
+            # Success is a redirect back to the consultation, while an expired
+            # session redirects to the login page and a rejected import to the
+            # import form again
+            location = response.headers.get("Location") or ""
+            logger.debug(f"Import response status: {response.status_code}")
+            release(response)
+            if response.status_code not in (301, 302, 303):
+                logger.error(
+                    f"Failed to import voters: status {response.status_code}"
+                    " instead of a redirect"
+                )
+                return False
+            if "/login" in location or "edit_new_voters" in location:
+                logger.error(f"Failed to import voters. Redirected to: {location}")
+                return False
 
-            # If we're still on the import page, something went wrong
-            logger.error(f"Failed to import voters. Final URL: {response.url}")
-            logger.debug(f"Response content: {response.text[:500]}...")
-            return False
+            logger.info(f"Successfully imported {email_count} voters")
+            return True
 
         except Exception as e:
             logger.error(f"Error importing voters: {str(e)}")
             logger.exception("Traceback:")
             return False
 
+    def process_election(self, config, dir_path, election_bundle=None):
+        """Create the election described by an election directory or its bundle."""
+        dir_name = os.path.basename(os.path.normpath(dir_path))
+        logger.info(f"\nProcessing election in directory: {dir_name}")
+
+        with profiler.phase("candidates load"):
+            candidates_data, voters = bundle.load_election_data(
+                dir_path, election_bundle
+            )
+        if candidates_data is None:
+            logger.error(f"Missing required files in directory: {dir_name}")
+            return None
+
+        # Create custom title from directory name
+        custom_title = f"PPD 2025 - {dir_name.replace('_', ' ')}"
+        logger.info(f"Creating election with title: {custom_title}")
+
+        # Create a copy of config with the custom title
+        election_config = config.copy()
+        election_config["title"] = custom_title
+
+        # Create the election, within the election time budget if any
+        with transport.deadline(self.election_deadline):
+            election_id = self.create_election(election_config, voters, candidates_data)
+
+        if election_id:
+            logger.info(f"Election created with ID: {election_id}")
+
+        return election_id
+
     def process_all_elections(self, elections_dir="elections/"):
         """Process all elections in the specified directory."""
         elections_dir = os.path.join(ROOT_DIR, elections_dir)
@@ -594,60 +749,45 @@ class BalotiloAutomation:
             return
 
         # Load the common YAML config
-        config_file = os.path.join(elections_dir, "config.yaml")
-        if not os.path.exists(config_file):
-            logger.error(
-                f"Directory '{elections_dir}' does not contain yaml configuration file."
-            )
+        config = load_config(elections_dir)
+        if config is None:
             return
 
-        with open(config_file, "r") as f:
-            config = yaml.safe_load(f)
-
-        # Process each subdirectory
-        for dir_name in sorted(os.listdir(elections_dir)):
-            dir_path = os.path.join(elections_dir, dir_name)
-
-            if not os.path.isdir(dir_path):
-                continue
-
-            logger.info(f"\nProcessing election in directory: {dir_name}")
-
-            # Find the YAML, voters, and candidates files
-            voters_file = None
-            candidates_file = None
-
-            for file_name in os.listdir(dir_path):
-                file_path = os.path.join(dir_path, file_name)
-
-                if file_name.endswith(".yaml") or file_name.endswith(".yml"):
-                    candidates_file = file_path
-                elif "voters" in file_name.lower() and file_name.endswith(".txt"):
-                    voters_file = file_path
-
-            if not voters_file or not candidates_file:
-                logger.error(f"Missing required files in directory: {dir_name}")
-                continue
-
-            # Create custom title from directory name
-            custom_title = f"PPD 2025 - {dir_name.replace('_', ' ')}"
-            logger.info(f"Creating election with title: {custom_title}")
-
-            # Create a copy of config with the custom title
-            election_config = config.copy()
-            election_config["title"] = custom_title
-
-            # Create the election
-            election_id = self.create_election(
-                election_config, voters_file, candidates_file
+        # Packed campaign if any, memory mapped once for all the elections
+        campaign = bundle.load_campaign(elections_dir)
+
+        # Process each subdirectory, the longest ones first
+        model = scheduler.CostModel(elections_dir)
+        estimates = model.estimate(list_election_dirs(elections_dir), campaign)
+        mapping = load_mapping(elections_dir)
+        timings = []
+        for dir_path in scheduler.largest_first(estimates):
+            start = time.perf_counter()
+            election_id = self.process_election(
+                config, dir_path, campaign.get(os.path.basename(dir_path))
             )
+            duration = time.perf_counter() - start
 
+            estimate = estimates[dir_path]
             if election_id:
-                logger.info(f"Election created with ID: {election_id}")
+                model.record(
+                    dir_path, estimate["features"], estimate["predicted"], duration
+                )
+                mapping[os.path.basename(dir_path)] = {
+                    "account": self.username,
+                    "election_id": election_id,
+                }
+                save_mapping(elections_dir, mapping)
+            timings.append(
+                (os.path.basename(dir_path), estimate["predicted"], duration)
+            )
 
             # Wait a bit before processing the next election to avoid rate limiting
             time.sleep(2)
 
+        model.save()
+        scheduler.report(timings)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -660,8 +800,51 @@ if __name__ == "__main__":
         default="elections/",
         help="Directory containing election data (default: elections/)",
     )
+    parser.add_argument(
+        "--transport-config",
+        help="YAML file overriding the default timeouts, pool sizes, election deadline and hedging",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="Profile each phase (CPU and memory) and write the reports to DIR",
+    )
+    parser.add_argument(
+        "--cassette",
+        help="Gzipped cassette file to record HTTP exchanges to or replay them from",
+    )
+    parser.add_argument(
+        "--cassette-mode",
+        choices=["record", "replay"],
+        default="replay",
+        help="Whether to record or replay the cassette (default: replay)",
+    )
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        default=0.0,
+        help="Replay speed factor, 1.0 is real time and 0 disables delays (default: 0)",
+    )
 
     args = parser.parse_args()
 
-    automation = BalotiloAutomation(args.username, args.password)
-    automation.process_all_elections(args.elections_dir)
+    automation = BalotiloAutomation(
+        args.username,
+        args.password,
+        transport_config=transport.load_transport_config(args.transport_config),
+    )
+    if args.cassette:
+        cassette.attach(
+            automation.session,
+            args.cassette,
+            mode=args.cassette_mode,
+            speed=args.replay_speed,
+        )
+    if args.profile:
+        profiler.enable(args.profile)
+
+    try:
+        automation.process_all_elections(args.elections_dir)
+    finally:
+        if args.profile:
+            logger.info(f"Profiling summary:\n{profiler.write_reports()}")
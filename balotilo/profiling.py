@@ -0,0 +1,124 @@
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import re
+import threading
+import time
+import tracemalloc
+
+# Opt-in CPU and memory profiling of the named phases of the pipeline. Code wraps
+# its phases in `with profiler.phase("name"):` (or decorates them with
+# `@profiler.profiled("name")`), which does nothing until
+# profiler.enable() is called (--profile option of the entry points). When
+# enabled, each phase accumulates a cProfile profile, written as a .pstats file
+# (readable by pstats, snakeviz, flameprof or gprof2dot), and its wall time and
+# tracemalloc peak memory are summed up in memory.json / summary.txt.
+
+_DISABLED = contextlib.nullcontext()
+
+
+class Profiler:
+    def __init__(self):
+        self.output_dir = None
+        self._profiles = {}
+        self._stats = {}
+        # Highest traced memory of the process, as phases reset the tracemalloc peak
+        self._process_peak = 0
+        # cProfile and tracemalloc peaks are process wide: only one phase at a
+        # time is profiled, phases nested in it or concurrent to it only get timed
+        self._active = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.output_dir is not None
+
+    def enable(self, output_dir):
+        """Start profiling, reports being written to output_dir."""
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def phase(self, name):
+        """Context manager profiling a named phase, free when disabled."""
+        if self.output_dir is None:
+            return _DISABLED
+        return self._profile_phase(name)
+
+    def profiled(self, name):
+        """Decorator profiling every call of a function as a named phase."""
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    @contextlib.contextmanager
+    def _profile_phase(self, name):
+        stats = self._stats.setdefault(
+            name, {"calls": 0, "wall_seconds": 0.0, "peak_bytes": 0}
+        )
+        owner = self._active.acquire(blocking=False)
+        profile = None
+        if owner:
+            profile = self._profiles.setdefault(name, cProfile.Profile())
+            self._record_process_peak()
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+            profile.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats["calls"] += 1
+            stats["wall_seconds"] += time.perf_counter() - start
+            if owner:
+                profile.disable()
+                peak = tracemalloc.get_traced_memory()[1] - start_memory
+                self._record_process_peak()
+                stats["peak_bytes"] = max(stats["peak_bytes"], peak)
+                self._active.release()
+
+    def _record_process_peak(self):
+        self._process_peak = max(self._process_peak, tracemalloc.get_traced_memory()[1])
+
+    def write_reports(self):
+        """Write the per-phase reports and return a short text summary."""
+        if not self.enabled:
+            return ""
+        for name, profile in self._profiles.items():
+            slug = re.sub(r"\W+", "_", name).strip("_")
+            profile.dump_stats(os.path.join(self.output_dir, f"{slug}.pstats"))
+
+        self._record_process_peak()
+        process_peak = self._process_peak
+        with open(os.path.join(self.output_dir, "memory.json"), "w") as f:
+            json.dump(
+                {"phases": self._stats, "process_peak_bytes": process_peak},
+                f,
+                indent=2,
+            )
+
+        lines = [f"{'phase':20} {'calls':>6} {'wall (s)':>10} {'peak (MiB)':>11}"]
+        for name, stats in self._stats.items():
+            lines.append(
+                f"{name:20} {stats['calls']:6} {stats['wall_seconds']:10.3f} "
+                f"{stats['peak_bytes'] / 2**20:11.2f}"
+            )
+        lines.append(f"Peak traced memory: {process_peak / 2**20:.2f} MiB")
+        lines.append(f"Profiles written to {self.output_dir}")
+        summary = "\n".join(lines)
+        with open(os.path.join(self.output_dir, "summary.txt"), "w") as f:
+            f.write(summary + "\n")
+        return summary
+
+
+# Shared by all the modules of a process
+profiler = Profiler()
@@ -0,0 +1,160 @@
+import heapq
+import json
+import logging
+import os
+import statistics
+
+import yaml
+
+import bundle
+from compression import open_input, strip_compression_suffix
+from elections import find_election_files
+
+# Cost-aware ordering of elections. The cost of an election is estimated from its
+# number of lists and candidates and the size of its voters file, then corrected
+# with the durations measured during previous runs, stored next to the elections.
+
+logger = logging.getLogger(__name__)
+
+TIMINGS_FILE = ".balotilo_timings.json"
+
+# Seconds per unit of each feature, before correction by the measured timings
+DEFAULT_WEIGHTS = {
+    "base": 4.0,
+    "lists": 0.5,
+    "candidates": 0.01,
+    "voter_bytes": 0.00002,
+}
+
+
+def voters_file_size(voters_file):
+    """Size of a voters file, once decompressed if it is compressed."""
+    if strip_compression_suffix(voters_file) == voters_file:
+        return os.path.getsize(voters_file)
+    size = 0
+    with open_input(voters_file, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            size += len(chunk)
+    return size
+
+
+def election_features(dir_path, election_bundle=None):
+    """Workload features of an election directory or of its bundle."""
+    features = {"lists": 0, "candidates": 0, "voter_bytes": 0}
+    if election_bundle is None:
+        election_bundle = bundle.read_fresh_bundle(dir_path)
+    candidates_data = election_bundle.get("candidates")
+    voters = election_bundle.get("voters")
+
+    # Fields missing from the bundle come from the folder files
+    voters_file, candidates_file = find_election_files(dir_path)
+    if candidates_data is None and candidates_file:
+        with open_input(candidates_file) as f:
+            candidates_data = yaml.safe_load(f)
+    if candidates_data:
+        features["lists"] = len(candidates_data)
+        features["candidates"] = sum(len(c or []) for c in candidates_data.values())
+    if voters is not None:
+        # Size the voters.txt file would have
+        features["voter_bytes"] = sum(
+            len(email.encode("utf-8")) + 1 for email in voters
+        )
+    elif voters_file:
+        features["voter_bytes"] = voters_file_size(voters_file)
+    return features
+
+
+class CostModel:
+    """Predicts the duration of elections, learning from previous runs."""
+
+    def __init__(self, elections_dir, weights=None):
+        self.timings_file = os.path.join(elections_dir, TIMINGS_FILE)
+        self.weights = weights or DEFAULT_WEIGHTS
+        self.history = {}
+        if os.path.exists(self.timings_file):
+            with open(self.timings_file, "r") as f:
+                self.history = json.load(f)
+
+    def raw_cost(self, features):
+        return self.weights["base"] + sum(
+            self.weights[name] * value for name, value in features.items()
+        )
+
+    def correction(self):
+        """Median ratio between measured and raw predicted durations."""
+        ratios = [
+            entry["actual"] / self.raw_cost(entry["features"])
+            for entry in self.history.values()
+            if entry.get("actual")
+        ]
+        return statistics.median(ratios) if ratios else 1.0
+
+    def predict(self, dir_name, features, correction=None):
+        """Predicted duration in seconds of an election."""
+        previous = self.history.get(dir_name)
+        if previous and previous.get("actual") and previous["features"] == features:
+            # Nothing changed since the last run, its duration is the best estimate
+            return previous["actual"]
+        if correction is None:
+            correction = self.correction()
+        return self.raw_cost(features) * correction
+
+    def estimate(self, dir_paths, campaign=None):
+        """Map each election directory to its features and predicted duration."""
+        correction = self.correction()
+        estimates = {}
+        for dir_path in dir_paths:
+            dir_name = os.path.basename(os.path.normpath(dir_path))
+            features = election_features(dir_path, (campaign or {}).get(dir_name))
+            estimates[dir_path] = {
+                "features": features,
+                "predicted": self.predict(dir_name, features, correction),
+            }
+        return estimates
+
+    def record(self, dir_path, features, predicted, actual):
+        dir_name = os.path.basename(os.path.normpath(dir_path))
+        self.history[dir_name] = {
+            "features": features,
+            "predicted": round(predicted, 3),
+            "actual": round(actual, 3),
+        }
+
+    def save(self):
+        with open(self.timings_file, "w") as f:
+            json.dump(self.history, f, indent=2, sort_keys=True)
+
+
+def largest_first(estimates):
+    """Election directories ordered by decreasing predicted duration."""
+    return sorted(estimates, key=lambda d: estimates[d]["predicted"], reverse=True)
+
+
+def balance(estimates, workers):
+    """Split elections between workers, minimizing the longest total duration.
+
+    Uses the longest-processing-time-first heuristic: each election, largest
+    first, goes to the currently least loaded worker.
+    """
+    bins = [(0.0, i, []) for i in range(workers)]
+    heapq.heapify(bins)
+    for dir_path in largest_first(estimates):
+        load, i, dirs = heapq.heappop(bins)
+        dirs.append(dir_path)
+        heapq.heappush(bins, (load + estimates[dir_path]["predicted"], i, dirs))
+    return [dirs for _, _, dirs in sorted(bins, key=lambda b: b[1])]
+
+
+def report(rows):
+    """Log predicted vs actual durations, rows being (name, predicted, actual)."""
+    logger.info(f"{'election':30} {'predicted':>10} {'actual':>10} {'error':>8}")
+    total_predicted = total_actual = 0.0
+    for name, predicted, actual in rows:
+        if actual is None:
+            logger.info(f"{name:30} {predicted:10.1f} {'-':>10} {'-':>8}")
+            continue
+        total_predicted += predicted
+        total_actual += actual
+        error = (actual - predicted) / predicted * 100 if predicted else 0.0
+        logger.info(f"{name:30} {predicted:10.1f} {actual:10.1f} {error:7.0f}%")
+    logger.info(f"{'total':30} {total_predicted:10.1f} {total_actual:10.1f}")
@@ -0,0 +1,359 @@
+import argparse
+import logging
+import os
+import sqlite3
+import time
+
+from accounts import account_automation, load_accounts, login_with_cache
+from elections import load_mapping
+from main import ROOT_DIR
+from sync import EMAIL_PATTERN
+
+# Support desk queue for the election day. Operators submit voter changes as
+# tickets from the command line, and an applier process imports the pending
+# tickets of each election together in a single import_new_voters request, as
+# soon as the oldest of them waited for the flush interval or enough of them
+# piled up to fill a batch. Each ticket keeps its own status and error.
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    election_dir TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    email TEXT NOT NULL,
+    voter_email TEXT NOT NULL,
+    note TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    error TEXT,
+    created_at REAL NOT NULL,
+    applied_at REAL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tickets_pending ON tickets (status, election_dir, id);
+"""
+
+# Ticket kinds, following the support playbook of the README
+KINDS = {
+    "add": "Add an eligible voter",
+    "proxy": "Upload a present voter again, as a proxy for themselves",
+    "alias": "Add a +bis alias, for members sharing an email address",
+    "alternative": "Add an alternative email address of a voter",
+}
+
+
+def bis_alias(email, suffix="bis"):
+    """original@gmail.com gives original+bis@gmail.com, delivered to the same inbox."""
+    local, domain = email.rsplit("@", 1)
+    return f"{local}+{suffix}@{domain}"
+
+
+def resolve_election_dir(mapping, department):
+    """Election directory of a department, given its directory name or number."""
+    if department in mapping:
+        return department
+    matches = [name for name in mapping if name.startswith(f"{department}_")]
+    if len(matches) != 1:
+        raise ValueError(f"No created election matches department '{department}'")
+    return matches[0]
+
+
+class SupportQueue:
+    """Support tickets stored in a SQLite database."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def submit(self, election_dir, kind, email, alternative=None, note=None):
+        """Add a ticket and return its ID."""
+        email = email.strip()
+        voter_email = email
+        if kind == "alias":
+            voter_email = bis_alias(email)
+        elif kind == "alternative":
+            if not alternative:
+                raise ValueError("An alternative ticket needs the alternative email")
+            voter_email = alternative.strip()
+        for address in (email, voter_email):
+            if not EMAIL_PATTERN.fullmatch(address):
+                raise ValueError(f"Invalid email address: {address}")
+
+        now = time.time()
+        cursor = self.conn.execute(
+            "INSERT INTO tickets "
+            "(election_dir, kind, email, voter_email, note, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (election_dir, kind, email, voter_email, note, now, now),
+        )
+        return cursor.lastrowid
+
+    def due_elections(self, interval, batch_size):
+        """Elections whose pending tickets waited long enough or fill a batch."""
+        now = time.time()
+        rows = self.conn.execute(
+            "SELECT election_dir, COUNT(*) AS pending, MIN(created_at) AS oldest "
+            "FROM tickets WHERE status = 'pending' GROUP BY election_dir"
+        ).fetchall()
+        return [
+            row["election_dir"]
+            for row in rows
+            if row["pending"] >= batch_size or row["oldest"] <= now - interval
+        ]
+
+    def claim(self, election_dir, batch_size):
+        """Mark up to batch_size pending tickets of an election as being applied."""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            tickets = [
+                dict(row)
+                for row in self.conn.execute(
+                    "SELECT * FROM tickets WHERE status = 'pending' "
+                    "AND election_dir = ? ORDER BY id LIMIT ?",
+                    (election_dir, batch_size),
+                )
+            ]
+            self.conn.executemany(
+                "UPDATE tickets SET status = 'applying', updated_at = ? WHERE id = ?",
+                [(now, ticket["id"]) for ticket in tickets],
+            )
+            self.conn.execute("COMMIT")
+            return tickets
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def finish(self, ticket_ids, error=None):
+        """Record the outcome of applied tickets."""
+        now = time.time()
+        self.conn.executemany(
+            "UPDATE tickets SET status = ?, error = ?, applied_at = ?, updated_at = ? "
+            "WHERE id = ?",
+            [
+                ("failed" if error else "done", error, now, now, ticket_id)
+                for ticket_id in ticket_ids
+            ],
+        )
+
+    def requeue(self, statuses=("failed",)):
+        """Put tickets back to pending, returning how many were."""
+        now = time.time()
+        cursor = self.conn.execute(
+            f"UPDATE tickets SET status = 'pending', error = NULL, updated_at = ? "
+            f"WHERE status IN ({', '.join('?' for _ in statuses)})",
+            (now, *statuses),
+        )
+        return cursor.rowcount
+
+    def tickets(self, statuses=None):
+        query = "SELECT * FROM tickets"
+        params = ()
+        if statuses:
+            query += f" WHERE status IN ({', '.join('?' for _ in statuses)})"
+            params = tuple(statuses)
+        return [dict(row) for row in self.conn.execute(query + " ORDER BY id", params)]
+
+    def close(self):
+        self.conn.close()
+
+
+class Applier:
+    """Applies the pending tickets, one voter import per election and batch."""
+
+    def __init__(
+        self,
+        queue,
+        accounts,
+        elections_dir="elections/",
+        interval=10,
+        batch_size=100,
+        poll_interval=1,
+    ):
+        self.queue = queue
+        self.accounts = {account["username"]: account for account in accounts}
+        self.elections_dir = os.path.join(ROOT_DIR, elections_dir)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._automations = {}
+
+    def _automation_for(self, username):
+        """Logged in automation of an account, kept until one of its imports fails."""
+        if username not in self._automations:
+            account = self.accounts.get(username)
+            if account is None:
+                raise RuntimeError(f"No credentials for account {username}")
+            automation = account_automation(account)
+            if not login_with_cache(automation):
+                raise RuntimeError(f"Could not log in with account {username}")
+            self._automations[username] = automation
+        return self._automations[username]
+
+    def _import_voters(self, entry, emails):
+        automation = self._automation_for(entry["account"])
+        return automation._import_voters(entry["election_id"], "\n".join(emails))
+
+    def apply(self, election_dir, tickets):
+        """Import the voters of a batch of tickets of one election."""
+        ticket_ids = [ticket["id"] for ticket in tickets]
+        # Duplicated tickets are imported once
+        emails = list(dict.fromkeys(ticket["voter_email"] for ticket in tickets))
+        try:
+            entry = load_mapping(self.elections_dir).get(election_dir)
+            if entry is None:
+                raise RuntimeError(f"No created election for {election_dir}")
+            if not self._import_voters(entry, emails):
+                # The session may have expired, log in again before retrying
+                logger.warning(f"{election_dir}: import failed, logging in again")
+                self._automations.pop(entry["account"], None)
+                if not self._import_voters(entry, emails):
+                    raise RuntimeError("Voters import failed")
+        except Exception as e:
+            logger.error(f"{election_dir}: tickets {ticket_ids} failed: {str(e)}")
+            self.queue.finish(ticket_ids, str(e))
+            return False
+
+        logger.info(
+            f"{election_dir}: imported {len(emails)} voters for tickets {ticket_ids}"
+        )
+        self.queue.finish(ticket_ids)
+        return True
+
+    def flush(self, force=False):
+        """Apply the due batches, or all the pending tickets with force."""
+        interval = 0 if force else self.interval
+        applied = 0
+        for election_dir in self.queue.due_elections(interval, self.batch_size):
+            while True:
+                tickets = self.queue.claim(election_dir, self.batch_size)
+                if tickets:
+                    self.apply(election_dir, tickets)
+                    applied += len(tickets)
+                # Only full batches are sent before the interval elapsed
+                if len(tickets) < self.batch_size or election_dir not in (
+                    self.queue.due_elections(interval, self.batch_size)
+                ):
+                    break
+        return applied
+
+    def run(self, once=False):
+        """Apply tickets as they come, or only the pending ones with once."""
+        # Tickets left being applied by an interrupted applier are applied again
+        self.queue.requeue(("applying",))
+        if once:
+            return self.flush(force=True)
+        logger.info(f"Applying tickets every {self.interval}s or by {self.batch_size}")
+        while True:
+            self.flush()
+            time.sleep(self.poll_interval)
+
+
+def print_tickets(tickets):
+    now = time.time()
+    for ticket in tickets:
+        waited = (ticket["applied_at"] or now) - ticket["created_at"]
+        target = ticket["voter_email"]
+        if target != ticket["email"]:
+            target = f"{ticket['email']} -> {target}"
+        print(
+            f"#{ticket['id']:<5} {ticket['status']:8} {ticket['election_dir']:30} "
+            f"{ticket['kind']:11} {target} ({waited:.0f}s) {ticket['error'] or ''}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Queue and apply support desk voter changes during the elections"
+    )
+    parser.add_argument(
+        "--db",
+        default="balotilo_support.sqlite",
+        help="SQLite database holding the tickets (default: balotilo_support.sqlite)",
+    )
+    parser.add_argument(
+        "--elections-dir",
+        default="elections/",
+        help="Directory containing election data (default: elections/)",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for kind, help_text in KINDS.items():
+        kind_parser = subparsers.add_parser(kind, help=help_text)
+        kind_parser.add_argument(
+            "department", help="Election directory name, or department number"
+        )
+        kind_parser.add_argument("email", help="Email address of the voter")
+        if kind == "alternative":
+            kind_parser.add_argument("alternative", help="Email address to add")
+        kind_parser.add_argument("--note", help="Free text, like the ticket reference")
+
+    apply_parser = subparsers.add_parser("apply", help="Apply the tickets")
+    apply_parser.add_argument(
+        "accounts_file", help="YAML file listing the accounts usernames and passwords"
+    )
+    apply_parser.add_argument(
+        "--interval",
+        type=float,
+        default=10,
+        help="Seconds a ticket waits for others of its election (default: 10)",
+    )
+    apply_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=100,
+        help="Tickets of an election applied at once at most (default: 100)",
+    )
+    apply_parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Apply the pending tickets and exit, instead of running continuously",
+    )
+
+    status_parser = subparsers.add_parser("status", help="Show the tickets")
+    status_parser.add_argument(
+        "--all", action="store_true", help="Also show the applied tickets"
+    )
+
+    subparsers.add_parser("retry", help="Put the failed tickets back to pending")
+
+    args = parser.parse_args()
+
+    queue = SupportQueue(args.db)
+    try:
+        if args.command in KINDS:
+            try:
+                election_dir = resolve_election_dir(
+                    load_mapping(os.path.join(ROOT_DIR, args.elections_dir)),
+                    args.department,
+                )
+                ticket_id = queue.submit(
+                    election_dir,
+                    args.command,
+                    args.email,
+                    getattr(args, "alternative", None),
+                    args.note,
+                )
+            except ValueError as e:
+                parser.error(str(e))
+            print(f"Ticket #{ticket_id} queued for {election_dir}")
+        elif args.command == "apply":
+            Applier(
+                queue,
+                load_accounts(args.accounts_file),
+                args.elections_dir,
+                interval=args.interval,
+                batch_size=args.batch_size,
+            ).run(once=args.once)
+        elif args.command == "status":
+            print_tickets(
+                queue.tickets(None if args.all else ("pending", "applying", "failed"))
+            )
+        elif args.command == "retry":
+            print(f"{queue.requeue()} tickets put back to pending")
+    finally:
+        queue.close()
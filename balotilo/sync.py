@@ -0,0 +1,328 @@
+import argparse
+import logging
+import os
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+import bundle
+from accounts import account_automation, load_accounts, login_with_cache
+from elections import load_mapping
+from main import ROOT_DIR
+
+# Incremental sync of already created elections with their local bundle. The
+# current voters and lists of each election are fetched and diffed against the
+# local voters.txt and candidates.yaml (or bundle.msgpack), then only the added
+# voters are uploaded and only the lists that changed are submitted.
+
+logger = logging.getLogger(__name__)
+
+# Page listing the voters of an election, and edition form of an election
+VOTERS_PATH = "/consultations/{election_id}/voters"
+EDIT_PATH = "/consultations/{election_id}/edit"
+
+EMAIL_PATTERN = re.compile(r"[\w.+'-]+@[\w-]+(?:\.[\w-]+)+")
+
+# consultation[questions_attributes][<question>][<collection>][<list>][<field>]
+LIST_FIELD_PATTERN = re.compile(
+    r"^(consultation\[questions_attributes\]\[([^\]]+)\]\[(\w*lists\w*)\]\[([^\]]+)\])\[(\w+)\]$"
+)
+
+
+def html_lines(html):
+    """Text lines of a rich text field, as <p>a<br>b</p> gives ["a", "b"]."""
+    html = re.sub(r"<br\s*/?>|</p>", "\n", html or "", flags=re.IGNORECASE)
+    html = BeautifulSoup(html, "html.parser").get_text()
+    return [line.strip() for line in html.split("\n") if line.strip()]
+
+
+def form_fields(form):
+    """Fields a browser would submit for a form, as (name, value) pairs."""
+    fields = []
+    for field in form.find_all(["input", "textarea", "select"]):
+        name = field.get("name")
+        if not name:
+            continue
+        if field.name == "textarea":
+            fields.append((name, field.text))
+        elif field.name == "select":
+            option = field.find("option", selected=True) or field.find("option")
+            fields.append((name, option.get("value", option.text) if option else ""))
+        elif field.get("type") in ("submit", "button", "file"):
+            continue
+        elif field.get("type") in ("checkbox", "radio") and not field.has_attr(
+            "checked"
+        ):
+            continue
+        else:
+            fields.append((name, field.get("value", "")))
+    return fields
+
+
+class ElectionSync:
+    """Brings one existing election up to date with its local bundle."""
+
+    def __init__(self, automation, election_id, dir_path):
+        self.automation = automation
+        self.election_id = election_id
+        self.dir_path = dir_path
+        self.base_url = automation.base_url
+        self.session = automation.session
+
+    def fetch_voters(self):
+        """Emails of the voters currently registered for the election.
+
+        Long voter lists are paginated, the pages are followed through their
+        rel="next" links.
+        """
+        emails = set()
+        url = self.base_url + VOTERS_PATH.format(election_id=self.election_id)
+        visited = set()
+        while url and url not in visited:
+            visited.add(url)
+            response = self.session.get(url)
+            response.raise_for_status()
+            emails.update(EMAIL_PATTERN.findall(response.text))
+            next_link = BeautifulSoup(response.text, "html.parser").find(
+                ["a", "link"], rel="next", href=True
+            )
+            url = urljoin(response.url, next_link["href"]) if next_link else None
+        logger.debug(
+            f"Election {self.election_id}: {len(emails)} voters on {len(visited)} pages"
+        )
+        return emails
+
+    def load_local(self):
+        """Local candidate lists and voters of the election."""
+        candidates_data, voters = bundle.load_election_data(self.dir_path)
+        if candidates_data is None:
+            raise RuntimeError(f"Missing voters or candidates in {self.dir_path}")
+        return candidates_data, voters
+
+    def sync_voters(self, dry_run=False):
+        """Upload the local voters missing from the election."""
+        _, voters = self.load_local()
+        remote = {email.lower() for email in self.fetch_voters()}
+        added = [
+            email for email in dict.fromkeys(voters) if email.lower() not in remote
+        ]
+        logger.info(f"Election {self.election_id}: {len(added)} voters to add")
+        if added and not dry_run:
+            if not self.automation._import_voters(self.election_id, "\n".join(added)):
+                raise RuntimeError("Voters import failed")
+        return len(added)
+
+    def fetch_form(self):
+        """Edition form of the election and the lists it currently has."""
+        response = self.session.get(
+            self.base_url + EDIT_PATH.format(election_id=self.election_id)
+        )
+        response.raise_for_status()
+        soup = BeautifulSoup(response.text, "html.parser")
+        form = soup.find("form", id=re.compile(r"^edit_consultation"))
+        if not form:
+            raise RuntimeError("Could not find the election edition form")
+
+        fields = form_fields(form)
+        lists = defaultdict(dict)
+        for name, value in fields:
+            match = LIST_FIELD_PATTERN.match(name)
+            if match:
+                prefix, question_id, _, _, field = match.groups()
+                lists[prefix]["question_id"] = question_id
+                lists[prefix][field] = value
+
+        remote_lists = {}
+        for prefix, values in lists.items():
+            if "title" not in values or values.get("_destroy") in ("1", "true"):
+                continue
+            title = " ".join(html_lines(values["title"]))
+            remote_lists[title] = {
+                "prefix": prefix,
+                "question_id": values["question_id"],
+                "candidates": html_lines(values.get("joined_candidates")),
+            }
+        return form, fields, remote_lists
+
+    def sync_lists(self, dry_run=False):
+        """Submit the lists which were added, changed or removed locally."""
+        local_lists = self.load_local()[0] or {}
+
+        form, fields, remote_lists = self.fetch_form()
+        added = local_lists.keys() - remote_lists.keys()
+        removed = remote_lists.keys() - local_lists.keys()
+        changed = {
+            title
+            for title in local_lists.keys() & remote_lists.keys()
+            if list(local_lists[title]) != remote_lists[title]["candidates"]
+        }
+        logger.info(
+            f"Election {self.election_id}: {len(added)} lists added, "
+            f"{len(changed)} changed, {len(removed)} removed"
+        )
+        if dry_run or not (added or changed or removed):
+            return len(added), len(changed), len(removed)
+
+        # Only the touched lists are submitted, the other ones are left as is
+        touched = {remote_lists[title]["prefix"] for title in changed | removed}
+        data = []
+        for name, value in fields:
+            match = LIST_FIELD_PATTERN.match(name)
+            if match and match.group(1) not in touched:
+                continue
+            data.append((name, value))
+        data = dict(data)
+
+        for title in changed:
+            prefix = remote_lists[title]["prefix"]
+            data[f"{prefix}[joined_candidates]"] = (
+                "<p>" + "<br>".join(local_lists[title]) + "</p>"
+            )
+        for title in removed:
+            data[f"{remote_lists[title]['prefix']}[_destroy]"] = "1"
+
+        if added:
+            self._add_lists(form, data, {title: local_lists[title] for title in added})
+
+        action = form.get("action") or EDIT_PATH.format(election_id=self.election_id)
+        response = self.session.post(
+            action if action.startswith("http") else f"{self.base_url}{action}",
+            data=data,
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9",
+                "Origin": self.base_url,
+                "Referer": self.base_url
+                + EDIT_PATH.format(election_id=self.election_id),
+            },
+            allow_redirects=False,
+        )
+        if response.status_code not in (301, 302, 303):
+            raise RuntimeError(
+                f"Lists update failed with status {response.status_code}"
+            )
+        return len(added), len(changed), len(removed)
+
+    def _add_lists(self, form, data, new_lists):
+        """Request templates for new lists and add them to the submitted data."""
+        lists_container = form.find("div", class_="lists")
+        question_input = form.find(
+            "input",
+            {"name": re.compile(r"questions_attributes\]\[[^\]]+\]\[_destroy\]$")},
+        )
+        if not lists_container or not question_input:
+            raise RuntimeError("Could not find where to add lists in the edition form")
+        question_id = question_input["name"].split("[")[2].split("]")[0]
+        csrf_token = data.get("authenticity_token")
+        headers = {
+            "Turbo-Method": "GET",
+            "Turbo-Stream": "true",
+            "Accept": "text/vnd.turbo-stream.html, text/html, application/xhtml+xml",
+            "X-CSRF-Token": csrf_token,
+        }
+        for title, candidates in new_lists.items():
+            list_id = self.automation._request_list_id(
+                lists_container.get("id"), question_id, headers
+            )
+            if not list_id:
+                raise RuntimeError(f"Could not get a list ID for list: {title}")
+            prefix = f"consultation[questions_attributes][{question_id}][list_voting_new_lists][{list_id}]"
+            data[f"{prefix}[_destroy]"] = ""
+            data[f"{prefix}[title]"] = f"<p>{title}</p>"
+            data[f"{prefix}[joined_candidates]"] = (
+                "<p>" + "<br>".join(candidates) + "</p>"
+            )
+
+    def run(self, dry_run=False):
+        voters = self.sync_voters(dry_run)
+        lists = self.sync_lists(dry_run)
+        return voters, lists
+
+
+def sync_all(accounts, elections_dir="elections/", workers=4, dry_run=False):
+    """Sync every election of the mapping file, in parallel within each account."""
+    elections_dir = os.path.join(ROOT_DIR, elections_dir)
+    mapping = load_mapping(elections_dir)
+    if not mapping:
+        logger.error(f"No created elections recorded in '{elections_dir}'")
+        return {}
+
+    by_username = {account["username"]: account for account in accounts}
+    results = {}
+    for username in sorted({entry["account"] for entry in mapping.values()}):
+        account = by_username.get(username)
+        if account is None:
+            logger.error(
+                f"No credentials for account {username}, skipping its elections"
+            )
+            continue
+        automation = account_automation(account)
+        if not login_with_cache(automation):
+            logger.error(f"Could not log in with account {username}")
+            continue
+
+        def sync_one(dir_name):
+            entry = mapping[dir_name]
+            try:
+                election = ElectionSync(
+                    automation,
+                    entry["election_id"],
+                    os.path.join(elections_dir, dir_name),
+                )
+                return dir_name, election.run(dry_run)
+            except Exception as e:
+                logger.error(f"Sync of {dir_name} failed: {str(e)}")
+                return dir_name, None
+
+        owned = [
+            name for name, entry in mapping.items() if entry["account"] == username
+        ]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results.update(executor.map(sync_one, owned))
+
+    for dir_name, result in sorted(results.items()):
+        if result is None:
+            logger.info(f"{dir_name}: failed")
+        else:
+            voters, (added, changed, removed) = result
+            logger.info(
+                f"{dir_name}: +{voters} voters, lists +{added} ~{changed} -{removed}"
+            )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sync existing Balotilo elections with their local voters and lists"
+    )
+    parser.add_argument(
+        "accounts_file", help="YAML file listing the accounts usernames and passwords"
+    )
+    parser.add_argument(
+        "--elections-dir",
+        default="elections/",
+        help="Directory containing election data (default: elections/)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Elections synced in parallel per account (default: 4)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only report the differences, without changing the elections",
+    )
+
+    args = parser.parse_args()
+
+    sync_all(
+        load_accounts(args.accounts_file),
+        args.elections_dir,
+        workers=args.workers,
+        dry_run=args.dry_run,
+    )
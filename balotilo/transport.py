@@ -0,0 +1,303 @@
+import contextlib
+import copy
+import gzip
+import logging
+import re
+import threading
+import time
+import urllib.parse
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+import yaml
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Transport layer of BalotiloAutomation sessions: per-endpoint connect/read
+# timeouts, an overall deadline per election, connection pools sized for
+# concurrent use, and optional hedging of idempotent GETs, where a duplicate
+# request is fired when the first one is slower than the endpoint's p95 latency.
+# Large request bodies, like voter imports, can also be sent gzip compressed,
+# falling back to plain bodies on endpoints where the server rejects them.
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    "pool_connections": 4,
+    "pool_maxsize": 16,
+    "connect_timeout": 5,
+    "read_timeout": 30,
+    # Overall time budget in seconds to create an election, None for no limit
+    "election_deadline": None,
+    # Endpoints needing other timeouts, matched on the request path
+    "endpoints": [
+        {"pattern": r"/import_new_voters$", "read_timeout": 180},
+        {"pattern": r"^/consultations$", "read_timeout": 60},
+    ],
+    "hedge": {
+        "enabled": False,
+        # Delay before hedging while too few latencies are known for a p95
+        "delay": 1.0,
+        "min_samples": 20,
+        "patterns": [
+            r"^/consultations/add_question$",
+            r"^/consultations/add_list$",
+            r"^/consultations/new$",
+            r"^/login$",
+        ],
+    },
+    "compression": {
+        "enabled": False,
+        # Smaller bodies are not worth compressing
+        "min_bytes": 65536,
+        "patterns": [r"/import_new_voters$"],
+    },
+}
+
+# Statuses of a server not understanding a compressed body, which is then sent
+# again uncompressed (the parameters could not be read, so nothing was done)
+COMPRESSION_REJECTED = (400, 411, 413, 415, 422)
+
+_local = threading.local()
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """The time budget of the current election is spent."""
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """Bound the total time of the requests made by the current thread."""
+    if seconds is None:
+        yield
+        return
+    previous = getattr(_local, "expires", None)
+    expires = time.monotonic() + seconds
+    _local.expires = expires if previous is None else min(previous, expires)
+    try:
+        yield
+    finally:
+        _local.expires = previous
+
+
+def remaining_time():
+    """Seconds left before the current deadline, or None without deadline."""
+    expires = getattr(_local, "expires", None)
+    return None if expires is None else expires - time.monotonic()
+
+
+def load_transport_config(config_file=None):
+    """Default transport config, overridden by the keys of a YAML file."""
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    if config_file:
+        with open(config_file, "r") as f:
+            overrides = yaml.safe_load(f) or {}
+        hedge = overrides.pop("hedge", {})
+        compression = overrides.pop("compression", {})
+        endpoints = overrides.pop("endpoints", [])
+        config.update(overrides)
+        config["hedge"].update(hedge)
+        config["compression"].update(compression)
+        # Endpoints are merged by pattern, new ones taking precedence over defaults
+        defaults = {endpoint["pattern"]: endpoint for endpoint in config["endpoints"]}
+        added = []
+        for endpoint in endpoints:
+            if endpoint["pattern"] in defaults:
+                defaults[endpoint["pattern"]].update(endpoint)
+            else:
+                added.append(endpoint)
+        config["endpoints"] = added + config["endpoints"]
+    return config
+
+
+def endpoint_key(method, url):
+    """Method and path of a request, with election IDs replaced by a placeholder."""
+    path = urllib.parse.urlsplit(url).path or "/"
+    path = re.sub(
+        r"^/consultations/(?!new$|add_question$|add_list$)[^/]+",
+        r"/consultations/:id",
+        path,
+    )
+    return f"{method} {path}"
+
+
+class LatencyTracker:
+    """Keeps the last latencies of each endpoint to compute percentiles."""
+
+    def __init__(self, size=200):
+        self._samples = defaultdict(lambda: deque(maxlen=size))
+        self._lock = threading.Lock()
+
+    def add(self, key, seconds):
+        with self._lock:
+            self._samples[key].append(seconds)
+
+    def percentile(self, key, percent, min_samples=1):
+        with self._lock:
+            samples = sorted(self._samples[key])
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+
+class TransportAdapter(HTTPAdapter):
+    """HTTP adapter applying the transport config to every request."""
+
+    def __init__(self, config=None):
+        # Not named config, which HTTPAdapter already uses
+        self.settings = config or load_transport_config()
+        self.latencies = LatencyTracker()
+        self._endpoints = [
+            (re.compile(endpoint["pattern"]), endpoint)
+            for endpoint in self.settings["endpoints"]
+        ]
+        self._hedged = [re.compile(p) for p in self.settings["hedge"]["patterns"]]
+        self._compressed = [
+            re.compile(p) for p in self.settings["compression"]["patterns"]
+        ]
+        # Endpoints which rejected a compressed body
+        self._uncompressed = set()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # Rate budget of the session (see accounts.RateBudget), which hedged
+        # duplicates must also fit in as they bypass the adapters mounted above
+        self.budget = None
+        super().__init__(
+            pool_connections=self.settings["pool_connections"],
+            pool_maxsize=self.settings["pool_maxsize"],
+            # Only connection failures are retried, the request never reached the server
+            max_retries=Retry(
+                total=2, connect=2, read=0, status=0, redirect=0, backoff_factor=0.5
+            ),
+        )
+
+    def timeout_for(self, path):
+        connect = self.settings["connect_timeout"]
+        read = self.settings["read_timeout"]
+        for pattern, endpoint in self._endpoints:
+            if pattern.search(path):
+                connect = endpoint.get("connect_timeout", connect)
+                read = endpoint.get("read_timeout", read)
+                break
+        left = remaining_time()
+        if left is not None:
+            if left <= 0:
+                raise DeadlineExceeded(f"Election deadline exceeded before {path}")
+            connect, read = min(connect, left), min(read, left)
+        return connect, read
+
+    def send(self, request, stream=False, timeout=None, **kwargs):
+        path = urllib.parse.urlsplit(request.url).path or "/"
+        if timeout is None:
+            timeout = self.timeout_for(path)
+        key = endpoint_key(request.method, request.url)
+        if (
+            self.settings["hedge"]["enabled"]
+            and request.method == "GET"
+            and any(pattern.search(path) for pattern in self._hedged)
+        ):
+            return self._hedged_send(
+                key, request, stream=stream, timeout=timeout, **kwargs
+            )
+        compressed = self._compress(key, path, request)
+        if compressed is not None:
+            response = self._timed_send(
+                key, compressed, stream=stream, timeout=timeout, **kwargs
+            )
+            if response.status_code not in COMPRESSION_REJECTED:
+                return response
+            logger.warning(
+                f"{key} rejected a gzip body ({response.status_code}), "
+                "sending it uncompressed from now on"
+            )
+            self._uncompressed.add(key)
+            response.close()
+        return self._timed_send(key, request, stream=stream, timeout=timeout, **kwargs)
+
+    def _compress(self, key, path, request):
+        """Gzip compressed copy of a request, or None to send it as is."""
+        compression = self.settings["compression"]
+        body = request.body
+        if (
+            not compression["enabled"]
+            or key in self._uncompressed
+            or "Content-Encoding" in request.headers
+            or not any(pattern.search(path) for pattern in self._compressed)
+        ):
+            return None
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        # Streamed bodies (files, generators) are left alone
+        if not isinstance(body, bytes) or len(body) < compression["min_bytes"]:
+            return None
+        compressed = request.copy()
+        compressed.body = gzip.compress(body, compresslevel=6)
+        compressed.headers["Content-Encoding"] = "gzip"
+        compressed.headers["Content-Length"] = str(len(compressed.body))
+        return compressed
+
+    def _timed_send(self, key, request, **kwargs):
+        start = time.monotonic()
+        response = super().send(request, **kwargs)
+        self.latencies.add(key, time.monotonic() - start)
+        return response
+
+    def _hedged_send(self, key, request, **kwargs):
+        hedge = self.settings["hedge"]
+        delay = self.latencies.percentile(key, 95, hedge["min_samples"])
+        if delay is None:
+            delay = hedge["delay"]
+
+        executor = self._get_executor()
+        primary = executor.submit(self._timed_send, key, request, **kwargs)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        if self.budget is not None and not self.budget.try_acquire():
+            logger.debug(f"Not hedging {key}, no request left in the rate budget")
+            return primary.result()
+
+        logger.debug(f"Hedging {key} after {delay:.2f}s")
+        secondary = executor.submit(self._timed_send, key, request.copy(), **kwargs)
+        pending = {primary, secondary}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.add_done_callback(_close_response)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.settings["pool_maxsize"],
+                    thread_name_prefix="hedge",
+                )
+            return self._executor
+
+    def close(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+        super().close()
+
+
+def _close_response(future):
+    if future.exception() is None:
+        future.result().close()
+
+
+def attach(session, config=None, prefixes=("https://", "http://")):
+    """Mount a transport adapter on a requests session."""
+    adapter = TransportAdapter(config)
+    for prefix in prefixes:
+        session.mount(prefix, adapter)
+    return adapter
@@ -0,0 +1,349 @@
+import argparse
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import logging
+import os
+import select
+import struct
+import time
+
+import bundle
+from accounts import login_with_cache
+from elections import load_config, load_mapping, save_mapping
+from main import ROOT_DIR, BalotiloAutomation
+from sync import ElectionSync
+
+# Long running watch mode for the candidature and registration windows. The
+# elections directory is watched with inotify (or by polling its files where
+# inotify is not available), changes are debounced, and each changed department
+# is compared with the content hashes of its last pushed state: new departments
+# get their election created, and elections whose voters or lists changed are
+# synced, all through a single logged in session.
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = ".balotilo_watch.json"
+
+# inotify(7) event masks
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """Reports the election directories changed, using Linux inotify."""
+
+    def __init__(self, root):
+        self.root = root
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs = {}
+        self._add_watch(root)
+        for dir_name in os.listdir(root):
+            if os.path.isdir(os.path.join(root, dir_name)):
+                self._add_watch(os.path.join(root, dir_name))
+
+    def _add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed on {path}")
+        self._dirs[wd] = path
+
+    def wait(self, timeout):
+        """Names of the election directories changed, or None for all of them."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        data = os.read(self.fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            path = self._dirs.get(wd)
+            if path is None:
+                continue
+            if path == self.root:
+                # Only new or renamed election directories matter at the top level
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_watch(os.path.join(self.root, name))
+                    changed.add(name)
+            else:
+                changed.add(os.path.basename(path))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Reports the election directories changed, comparing file modification times."""
+
+    def __init__(self, root, interval=2):
+        self.root = root
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for dir_name in os.listdir(self.root):
+            dir_path = os.path.join(self.root, dir_name)
+            if not os.path.isdir(dir_path):
+                continue
+            files = {}
+            for entry in os.scandir(dir_path):
+                if entry.is_file():
+                    stat = entry.stat()
+                    files[entry.name] = (stat.st_mtime_ns, stat.st_size)
+            snapshot[dir_name] = files
+        return snapshot
+
+    def wait(self, timeout):
+        """Names of the election directories changed, polling until the timeout."""
+        deadline = time.monotonic() + (timeout if timeout is not None else 1e9)
+        while True:
+            time.sleep(max(0, min(self.interval, deadline - time.monotonic())))
+            snapshot = self._scan()
+            changed = {
+                dir_name
+                for dir_name in snapshot.keys() | self._snapshot.keys()
+                if snapshot.get(dir_name) != self._snapshot.get(dir_name)
+            }
+            self._snapshot = snapshot
+            if changed or time.monotonic() >= deadline:
+                return changed
+
+    def close(self):
+        pass
+
+
+def make_watcher(root, poll_interval=2, polling=False):
+    if not polling:
+        try:
+            return InotifyWatcher(root)
+        except (OSError, AttributeError, TypeError) as e:
+            # No inotify outside of Linux (missing libc symbol), or watch limit reached
+            logger.warning(f"inotify unavailable ({str(e)}), polling for changes")
+    return PollingWatcher(root, poll_interval)
+
+
+def content_hashes(candidates_data, voters):
+    """Hashes of the lists and the voters of an election, whatever their format."""
+
+    def digest(value):
+        data = json.dumps(value, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    return {"candidates": digest(candidates_data), "voters": digest(voters)}
+
+
+class ElectionWatcher:
+    """Pushes the changes of the election directories as they happen."""
+
+    def __init__(
+        self,
+        automation,
+        elections_dir="elections/",
+        debounce=2,
+        poll_interval=2,
+        retry_seconds=60,
+        polling=False,
+    ):
+        self.automation = automation
+        self.elections_dir = os.path.join(ROOT_DIR, elections_dir)
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.retry_seconds = retry_seconds
+        self.polling = polling
+        self.state_file = os.path.join(self.elections_dir, STATE_FILE)
+        self.state = {}
+        if os.path.exists(self.state_file):
+            with open(self.state_file, "r") as f:
+                self.state = json.load(f)
+        self.logged_in = False
+        # Directories whose push failed, tried again with the next changes
+        self.failed = set()
+
+    def save_state(self):
+        tmp_file = f"{self.state_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+        os.replace(tmp_file, self.state_file)
+
+    def push(self, dir_name, mapping):
+        """Push the changes of an election directory, if any."""
+        dir_path = os.path.join(self.elections_dir, dir_name)
+        if not os.path.isdir(dir_path):
+            return
+        candidates_data, voters = bundle.load_election_data(dir_path)
+        if candidates_data is None:
+            logger.info(f"{dir_name}: waiting for its voters and candidates")
+            return
+        hashes = content_hashes(candidates_data, voters)
+        previous = self.state.get(dir_name, {})
+        if hashes == previous:
+            return
+
+        entry = mapping.get(dir_name)
+        if entry is None:
+            config = load_config(self.elections_dir)
+            if config is None:
+                raise RuntimeError("Missing config.yaml")
+            election_id = self.automation.process_election(config, dir_path)
+            if not election_id:
+                raise RuntimeError("Election creation failed")
+            mapping[dir_name] = {
+                "account": self.automation.username,
+                "election_id": election_id,
+            }
+            save_mapping(self.elections_dir, mapping)
+            logger.info(f"{dir_name}: created election {election_id}")
+            # The lists are pushed, but the voters import of the creation may
+            # have failed: the voters are only recorded once synced
+            self.state[dir_name] = {"candidates": hashes["candidates"]}
+            self.save_state()
+            added = ElectionSync(self.automation, election_id, dir_path).sync_voters()
+            if added:
+                logger.info(f"{dir_name}: {added} voters added after the creation")
+        elif entry["account"] != self.automation.username:
+            logger.warning(
+                f"{dir_name}: owned by account {entry['account']}, not pushed"
+            )
+            return
+        else:
+            election = ElectionSync(self.automation, entry["election_id"], dir_path)
+            if hashes["voters"] != previous.get("voters"):
+                added = election.sync_voters()
+                logger.info(f"{dir_name}: {added} voters added")
+            if hashes["candidates"] != previous.get("candidates"):
+                added, changed, removed = election.sync_lists()
+                logger.info(f"{dir_name}: lists +{added} ~{changed} -{removed}")
+
+        self.state[dir_name] = hashes
+        self.save_state()
+
+    def push_all(self, dir_names):
+        """Push the changed directories, keeping track of the failed ones."""
+        if not self.logged_in:
+            self.logged_in = login_with_cache(self.automation)
+            if not self.logged_in:
+                logger.error("Login failed, retrying with the next changes")
+                self.failed |= dir_names
+                return
+        mapping = load_mapping(self.elections_dir)
+        for dir_name in sorted(dir_names):
+            try:
+                self.push(dir_name, mapping)
+                self.failed.discard(dir_name)
+            except Exception as e:
+                logger.error(f"{dir_name}: push failed: {str(e)}")
+                self.failed.add(dir_name)
+                # The session may have expired
+                self.logged_in = False
+
+    def all_dirs(self):
+        return {
+            dir_name
+            for dir_name in os.listdir(self.elections_dir)
+            if os.path.isdir(os.path.join(self.elections_dir, dir_name))
+        }
+
+    def run(self):
+        """Push the pending changes, then watch for new ones until interrupted."""
+        watcher = make_watcher(self.elections_dir, self.poll_interval, self.polling)
+        logger.info(f"Watching {self.elections_dir} with {type(watcher).__name__}")
+        try:
+            # Changes made while not watching
+            self.push_all(self.all_dirs())
+            while True:
+                changed = watcher.wait(self.retry_seconds if self.failed else None)
+                # Wait for the changes to settle, like a whole folder being copied
+                while changed is not None:
+                    more = watcher.wait(self.debounce)
+                    if more is None:
+                        # Events were lost, every directory is checked
+                        changed = None
+                        break
+                    if not more:
+                        break
+                    changed |= more
+                if changed is None:
+                    changed = self.all_dirs()
+                self.push_all(changed | self.failed)
+        finally:
+            watcher.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Watch the elections directory and push its changes to Balotilo"
+    )
+    parser.add_argument("username", help="Your Balotilo username (email)")
+    parser.add_argument("password", help="Your Balotilo password")
+    parser.add_argument(
+        "--elections-dir",
+        default="elections/",
+        help="Directory containing election data (default: elections/)",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=2,
+        help="Seconds without changes before pushing them (default: 2)",
+    )
+    parser.add_argument(
+        "--polling",
+        action="store_true",
+        help="Poll the files for changes instead of using inotify",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=2,
+        help="Seconds between two scans when polling (default: 2)",
+    )
+    parser.add_argument(
+        "--retry-seconds",
+        type=float,
+        default=60,
+        help="Seconds before failed pushes are tried again (default: 60)",
+    )
+
+    args = parser.parse_args()
+
+    watcher = ElectionWatcher(
+        BalotiloAutomation(args.username, args.password),
+        args.elections_dir,
+        debounce=args.debounce,
+        poll_interval=args.poll_interval,
+        retry_seconds=args.retry_seconds,
+        polling=args.polling,
+    )
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        logger.info("Stopped watching")
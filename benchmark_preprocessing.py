@@ -0,0 +1,175 @@
+import argparse
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from make_synthetic_data import generate
+
+# Benchmarks the preprocessing scripts on synthetic campaigns of growing size,
+# recording wall time, rows per second and peak RSS of each script at each scale.
+# Results are appended to a JSON lines file, and compared with the previous run
+# of the same script at the same scale to catch regressions.
+
+ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
+
+# Size of the campaign at scale 1
+BASE_DEPARTMENTS = 10
+BASE_MEMBERS = 10000
+BASE_LISTS_PER_DEPARTMENT = 3
+
+# Scripts in pipeline order, with the input whose rows they process
+SCRIPTS = [
+    ("simplify_candidatures.py", "candidatures"),
+    ("sort_lists.py", "candidatures"),
+    ("make_email_lists.py", "members"),
+    ("filter_eligible_voters.py", "members"),
+]
+
+
+def run_script(script, cwd):
+    """Run a script in a directory, returning its wall time and peak RSS in bytes."""
+    # stderr goes to a file, as a full pipe would block the script while waiting
+    with tempfile.TemporaryFile() as stderr_file:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT_DIR, script)],
+            cwd=cwd,
+            stdout=subprocess.DEVNULL,
+            stderr=stderr_file,
+        )
+        # wait4 gives the resource usage of this child only, and reaps it
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        process.wait()
+        stderr_file.seek(0)
+        stderr = stderr_file.read().decode("utf-8", errors="replace")
+    if process.returncode != 0:
+        raise RuntimeError(f"{script} failed:\n{stderr}")
+    # ru_maxrss is in kilobytes on Linux
+    return wall, usage.ru_maxrss * 1024
+
+
+def benchmark(scales, workdir, seed=0):
+    results = []
+    for scale in scales:
+        campaign_dir = os.path.join(workdir, f"scale_{scale}")
+        shutil.rmtree(campaign_dir, ignore_errors=True)
+        print(f"Generating campaign at scale {scale}...")
+        counts = generate(
+            campaign_dir,
+            departments=int(BASE_DEPARTMENTS * scale),
+            members=int(BASE_MEMBERS * scale),
+            lists_per_department=BASE_LISTS_PER_DEPARTMENT,
+            seed=seed,
+        )
+        for script, rows_kind in SCRIPTS:
+            wall, peak_rss = run_script(script, campaign_dir)
+            rows = counts[rows_kind]
+            result = {
+                "script": script,
+                "scale": scale,
+                "rows": rows,
+                "wall_seconds": round(wall, 3),
+                "rows_per_second": round(rows / wall, 1),
+                "peak_rss_bytes": peak_rss,
+            }
+            results.append(result)
+            print(
+                f"  {script:26} {rows:>10} rows {wall:9.2f}s "
+                f"{rows / wall:>12.0f} rows/s {peak_rss / 2**20:9.1f} MiB"
+            )
+        shutil.rmtree(campaign_dir, ignore_errors=True)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_previous(results_file):
+    """Latest recorded result of each (script, scale)."""
+    previous = {}
+    if os.path.exists(results_file):
+        with open(results_file, "r") as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    previous[(result["script"], result["scale"])] = result
+    return previous
+
+
+def find_regressions(results, previous, threshold):
+    """Results slower or bigger than their previous run by more than threshold."""
+    regressions = []
+    for result in results:
+        before = previous.get((result["script"], result["scale"]))
+        if not before:
+            continue
+        for metric in ("wall_seconds", "peak_rss_bytes"):
+            if before[metric] and result[metric] > before[metric] * (1 + threshold):
+                regressions.append(
+                    f"{result['script']} at scale {result['scale']}: {metric} "
+                    f"{before[metric]} -> {result[metric]}"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the preprocessing scripts on synthetic data"
+    )
+    parser.add_argument(
+        "--scales",
+        type=float,
+        nargs="+",
+        default=[1, 10, 100],
+        help="Campaign sizes, as multiples of the base size (default: 1 10 100)",
+    )
+    parser.add_argument(
+        "--results",
+        default="bench_results.jsonl",
+        help="JSON lines file the results are appended to (default: bench_results.jsonl)",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative slowdown or memory growth reported as a regression (default: 0.2)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args()
+
+    previous = load_previous(args.results)
+    with tempfile.TemporaryDirectory(prefix="balotilo_bench_") as workdir:
+        results = benchmark(args.scales, workdir, args.seed)
+
+    run_info = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+    }
+    with open(args.results, "a") as f:
+        for result in results:
+            f.write(json.dumps({**run_info, **result}) + "\n")
+    print(f"\nResults appended to {args.results}")
+
+    regressions = find_regressions(results, previous, args.threshold)
+    if regressions:
+        print("\nRegressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
@@ -0,0 +1,227 @@
+import argparse
+import datetime
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from balotilo import bundle
+from balotilo.compression import open_input
+from balotilo.profiling import profiler
+
+# Builds the per-department voter lists from the global member export, keeping
+# only the members eligible to vote: members at the cutoff date, with at least 3
+# months of membership. Successive membership periods separated by a gap shorter
+# than the tolerance are chained together, and their durations summed up.
+# Every member appears once, in voters.txt if eligible, or in ineligible.csv with
+# the reason why, in the folder of the department of their latest membership.
+
+EMAIL_COLUMN = "Email"
+FIRST_NAME_COLUMN = "Prénom"
+LAST_NAME_COLUMN = "Nom"
+DEPARTMENT_COLUMN = "Département"
+START_COLUMN = "Date d'adhésion"
+END_COLUMN = "Date de fin d'adhésion"  # Empty for ongoing memberships
+
+
+def read_members(input_file, dayfirst=False):
+    """One row per membership period, with parsed dates and normalized keys."""
+    with open_input(input_file) as f:
+        df = pd.read_csv(f, dtype=str, keep_default_na=False)
+    email = df[EMAIL_COLUMN].str.strip()
+    return pd.DataFrame(
+        {
+            "email": email,
+            # Members are identified by their email, whatever its case
+            "key": email.str.lower(),
+            "first_name": df.get(FIRST_NAME_COLUMN, ""),
+            "last_name": df.get(LAST_NAME_COLUMN, ""),
+            "department": df[DEPARTMENT_COLUMN].str.strip().str.zfill(2),
+            "start": pd.to_datetime(
+                df[START_COLUMN], errors="coerce", dayfirst=dayfirst
+            ),
+            "end": pd.to_datetime(df[END_COLUMN], errors="coerce", dayfirst=dayfirst),
+        }
+    )
+
+
+def compute_eligibility(periods, cutoff, min_months=3, gap_days=31):
+    """Eligibility of each member, with the reason of ineligible ones.
+
+    Returns one row per member (members without email are kept per row), with
+    their department, names, membership days, eligible flag and reason.
+    """
+    cutoff = pd.Timestamp(cutoff)
+    gap = pd.Timedelta(days=gap_days)
+    required_days = (cutoff - (cutoff - pd.DateOffset(months=min_months))).days
+
+    no_email = periods[periods["key"] == ""]
+    periods = periods[periods["key"] != ""]
+    # Integer member codes, much faster to sort and group than the emails
+    periods = periods.assign(member=pd.factorize(periods["key"])[0])
+    periods = periods.sort_values(["member", "start"], ignore_index=True)
+    # Department and names of the latest membership period of each member
+    members = periods[periods["member"] != periods["member"].shift(-1)]
+    members = members.set_index("member")
+
+    # Periods starting after the cutoff date (or without start date) do not count,
+    # ongoing ones count up to the cutoff date
+    counted = periods.loc[periods["start"] <= cutoff, ["member", "start", "end"]]
+    end = counted["end"].fillna(cutoff).clip(upper=cutoff)
+    end = end.where(end >= counted["start"], counted["start"])
+
+    # A period starts a new chain when it begins more than the tolerated gap after
+    # the end of all the previous periods of the member
+    members_end = end.groupby(counted["member"]).cummax()
+    previous_end = members_end.groupby(counted["member"]).shift()
+    new_chain = previous_end.isna() | (counted["start"] - previous_end > gap)
+    chain = new_chain.cumsum()
+    # Overlapping periods are only counted once
+    counted_start = counted["start"].where(
+        new_chain | (counted["start"] >= previous_end), previous_end
+    )
+    days = (end - counted_start).dt.days.clip(lower=0)
+
+    # The latest chain of each member is their current membership, it ends with
+    # their last period, where the running end is the end of the chain
+    last = counted["member"] != counted["member"].shift(-1)
+    current = pd.DataFrame(
+        {
+            "days": days.groupby(chain).sum().reindex(chain[last]).to_numpy(),
+            "end": members_end[last].to_numpy(),
+        },
+        index=counted["member"][last].to_numpy(),
+    )
+    members["days"] = current["days"].reindex(members.index).fillna(0).astype(int)
+    members["chain_end"] = current["end"].reindex(members.index)
+
+    reason = pd.Series("", index=members.index)
+    too_short = members["days"] < required_days
+    reason[too_short] = (
+        members.loc[too_short, "days"].astype(str)
+        + f" days of membership, {required_days} required"
+    )
+    lapsed = members["chain_end"] < cutoff - gap
+    reason[lapsed] = "membership ended on " + members.loc[
+        lapsed, "chain_end"
+    ].dt.strftime("%Y-%m-%d")
+    reason[members["chain_end"].isna()] = "no membership period before the cutoff date"
+    members["reason"] = reason
+    members["eligible"] = reason == ""
+
+    no_email = no_email.assign(days=0, eligible=False, reason="no email")
+    columns = ["email", "first_name", "last_name", "department", "days"]
+    return pd.concat(
+        [
+            members[columns + ["eligible", "reason"]],
+            no_email[columns + ["eligible", "reason"]],
+        ],
+        ignore_index=True,
+    )
+
+
+def department_folders(root="."):
+    """Department folders of the current directory, by department number."""
+    return {
+        folder.name.split("_", 1)[0]: folder
+        for folder in Path(root).iterdir()
+        if folder.is_dir() and "_" in folder.name
+    }
+
+
+def write_voter_lists(members, folders, use_bundle=False):
+    """Write voters.txt (or the bundle voters) and ineligible.csv of each folder."""
+    summary = []
+    for department, group in members.groupby("department", sort=True):
+        eligible = group[group["eligible"]]
+        ineligible = group[~group["eligible"]]
+        folder = folders.get(department)
+        if folder is None:
+            print(
+                f"Warning: No folder found for department {department}, "
+                f"{len(eligible)} eligible members skipped"
+            )
+            continue
+
+        if use_bundle:
+            bundle.update_bundle(folder, voters=eligible["email"].tolist())
+        else:
+            with open(os.path.join(folder, "voters.txt"), "w", encoding="utf-8") as f:
+                f.writelines(f"{email}\n" for email in eligible["email"])
+        ineligible[["email", "first_name", "last_name", "days", "reason"]].to_csv(
+            os.path.join(folder, "ineligible.csv"),
+            index=False,
+            header=["Email", "Prénom", "Nom", "Jours d'adhésion", "Raison"],
+        )
+        summary.append((folder.name, len(eligible), len(ineligible)))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Split the member export into per-department lists of eligible voters"
+    )
+    parser.add_argument(
+        "--input",
+        default="adherents.csv",
+        help="Member export, one row per membership period, possibly compressed "
+        "(default: adherents.csv)",
+    )
+    parser.add_argument(
+        "--cutoff",
+        type=datetime.date.fromisoformat,
+        default=datetime.date.today(),
+        help="Date at which eligibility is assessed, YYYY-MM-DD (default: today)",
+    )
+    parser.add_argument(
+        "--min-months",
+        type=int,
+        default=3,
+        help="Months of membership required to vote (default: 3)",
+    )
+    parser.add_argument(
+        "--gap-days",
+        type=int,
+        default=31,
+        help="Longest gap between two memberships still chained (default: 31)",
+    )
+    parser.add_argument(
+        "--dayfirst",
+        action="store_true",
+        help="Dates of the export are written DD/MM/YYYY",
+    )
+    parser.add_argument(
+        "--bundle",
+        action="store_true",
+        help=f"Save the voters in each folder {bundle.BUNDLE_FILE} instead of voters.txt",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="Profile the split (CPU and memory) and write the reports to DIR",
+    )
+    args = parser.parse_args()
+
+    if args.profile:
+        profiler.enable(args.profile)
+
+    with profiler.phase("eligibility"):
+        periods = read_members(args.input, args.dayfirst)
+        members = compute_eligibility(
+            periods, args.cutoff, args.min_months, args.gap_days
+        )
+        summary = write_voter_lists(members, department_folders(), args.bundle)
+
+    for folder, eligible, ineligible in summary:
+        print(f"{folder:30} {eligible:>8} eligible {ineligible:>8} ineligible")
+    print(
+        f"\n{len(periods)} membership periods, {len(members)} members, "
+        f"{int(members['eligible'].sum())} eligible at {args.cutoff}"
+    )
+
+    if args.profile:
+        print(f"\n{profiler.write_reports()}")
+
+
+if __name__ == "__main__":
+    main()
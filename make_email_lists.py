@@ -1,21 +1,30 @@
+import argparse
 import glob
 import os
 from pathlib import Path
 
 import pandas as pd
 
+from balotilo import bundle
+from balotilo.compression import open_input, strip_compression_suffix
+from balotilo.profiling import profiler
+
 # This script helps gets a global votant list and split it into small per-departement lists in subfolders, as expected by the script
 # creating the elections on balotilo
 
 
-def extract_emails_from_votants(folder_path):
+def extract_emails_from_votants(folder_path, use_bundle=False):
     """
     Extract emails from votants_xxx.csv file in a given folder
-    and save them to voters.txt
+    and save them to voters.txt, or to the folder bundle with use_bundle
     """
-    # Find votants_*.csv file in the folder
-    votants_pattern = os.path.join(folder_path, "votants_*.csv")
-    votants_files = glob.glob(votants_pattern)
+    # Find votants_*.csv file in the folder, possibly compressed
+    votants_pattern = os.path.join(folder_path, "votants_*.csv*")
+    votants_files = [
+        path
+        for path in sorted(glob.glob(votants_pattern))
+        if strip_compression_suffix(path).endswith(".csv")
+    ]
 
     if not votants_files:
         print(f"  No votants_*.csv file found in {folder_path}")
@@ -31,7 +40,8 @@ def extract_emails_from_votants(folder_path):
 
     try:
         # Read the CSV file
-        df = pd.read_csv(votants_file, encoding="utf-8")
+        with open_input(votants_file) as f:
+            df = pd.read_csv(f)
 
         # Check if Email column exists
         if "Email" not in df.columns:
@@ -42,6 +52,11 @@ def extract_emails_from_votants(folder_path):
         emails = df["Email"].dropna()
         emails = emails[emails.str.strip() != ""]
 
+        if use_bundle:
+            bundle.update_bundle(folder_path, voters=[e.strip() for e in emails])
+            print(f"  Saved {len(emails)} emails to {bundle.BUNDLE_FILE}")
+            return True
+
         # Save to voters.txt
         voters_file = os.path.join(folder_path, "voters.txt")
         with open(voters_file, "w", encoding="utf-8") as f:
@@ -56,7 +71,7 @@ def extract_emails_from_votants(folder_path):
         return False
 
 
-def process_all_subfolders():
+def process_all_subfolders(use_bundle=False):
     """
     Process all subfolders in the current directory
     """
@@ -74,7 +89,7 @@ def process_all_subfolders():
     for folder in sorted(subfolders):
         print(f"Processing folder: {folder.name}")
 
-        if extract_emails_from_votants(folder):
+        if extract_emails_from_votants(folder, use_bundle):
             processed_count += 1
         else:
             error_count += 1
@@ -91,16 +106,38 @@ def main():
     """
     Main function to run the script
     """
+    parser = argparse.ArgumentParser(
+        description="Extract voters emails from votants_*.csv files in each subfolder"
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="Profile the split (CPU and memory) and write the reports to DIR",
+    )
+    parser.add_argument(
+        "--bundle",
+        action="store_true",
+        help=f"Save the voters in each folder {bundle.BUNDLE_FILE} instead of voters.txt",
+    )
+    args = parser.parse_args()
+
+    if args.profile:
+        profiler.enable(args.profile)
+
     print("Email Extraction Script")
     print("=" * 50)
     print("This script will extract emails from votants_*.csv files")
     print("and save them as voters.txt in each subfolder.\n")
 
     # Process all subfolders
-    process_all_subfolders()
+    with profiler.phase("split"):
+        process_all_subfolders(args.bundle)
 
     print("\nDone!")
 
+    if args.profile:
+        print(f"\n{profiler.write_reports()}")
+
 
 if __name__ == "__main__":
     main()
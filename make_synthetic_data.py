@@ -0,0 +1,280 @@
+import argparse
+import csv
+import datetime
+import os
+import random
+
+# Generates realistic synthetic inputs for the preprocessing scripts, at any scale:
+# - candidatures.csv, with the messy names, emails and phone numbers of the real forms
+# - NN_name department folders, each with a votants_NN.csv member export
+# - adherents.csv, the global member export, one row per membership period
+
+FIRST_NAMES = [
+    "Jean",
+    "Marie",
+    "Pierre",
+    "Nathalie",
+    "Olivier",
+    "Sophie",
+    "Etienne",
+    "Laurence",
+    "Emmanuel",
+    "Camille",
+    "Jean-Pierre",
+    "Anne-Sophie",
+    "Mohamed",
+    "Fatima",
+    "Louis",
+    "Chloé",
+    "Hélène",
+    "François",
+    "Zoé",
+    "Mathéo",
+]
+LAST_NAMES = [
+    "MARTIN",
+    "BERNARD",
+    "DUBOIS",
+    "THOMAS",
+    "ROBERT",
+    "RICHARD",
+    "PETIT",
+    "DURAND",
+    "LEROY",
+    "MOREAU",
+    "SIMON",
+    "LAURENT",
+    "LEFEBVRE",
+    "MICHEL",
+    "GARCIA",
+    "D'ALEMBERT",
+    "DE LA FONTAINE",
+    "N'DIAYE",
+    "LE GALL",
+    "MARTIN-DUPONT",
+]
+DOMAINS = [
+    "gmail.com",
+    "yahoo.fr",
+    "orange.fr",
+    "free.fr",
+    "hotmail.com",
+    "laposte.net",
+]
+SYLLABLES = [
+    "ar",
+    "de",
+    "che",
+    "lo",
+    "ire",
+    "vau",
+    "mon",
+    "sa",
+    "ven",
+    "gar",
+    "nord",
+    "cal",
+]
+LIST_WORDS = [
+    "Place Publique",
+    "pour une gauche de terrain",
+    "sociale",
+    "écologique",
+    "et européenne",
+    "ensemble",
+    "demain",
+    "en commun",
+    "citoyenne",
+]
+EXPORT_DATE = datetime.date(2025, 5, 1)
+
+MEMBER_HEADER = [
+    "Email",
+    "Prénom",
+    "Nom",
+    "Département",
+    "Date d'adhésion",
+    "Date de fin d'adhésion",
+]
+
+
+def department_numbers(count):
+    """Department numbers, metropolitan first then overseas (971...)."""
+    numbers = [n for n in range(1, 96) if n != 20]
+    numbers += list(range(971, 977))
+    while len(numbers) < count:
+        numbers.append(numbers[-1] + 1)
+    return numbers[:count]
+
+
+def department_folder(number, rng):
+    name = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+    return f"{str(number).zfill(2)}_{name.capitalize()}"
+
+
+def person(rng):
+    first = rng.choice(FIRST_NAMES)
+    last = rng.choice(LAST_NAMES)
+    local = f"{first}.{last}".lower().replace(" ", "").replace("'", "")
+    email = f"{local}{rng.randint(1, 9999)}@{rng.choice(DOMAINS)}"
+    return first, last, email
+
+
+def phone(rng):
+    digits = f"0{rng.randint(6, 7)}" + "".join(str(rng.randint(0, 9)) for _ in range(8))
+    style = rng.randint(0, 3)
+    if style == 0:
+        return digits
+    pairs = [digits[i : i + 2] for i in range(0, 10, 2)]
+    if style == 1:
+        return " ".join(pairs)
+    if style == 2:
+        return ".".join(pairs)
+    return "+33 " + digits[1] + " " + " ".join(pairs[1:])
+
+
+def messy_candidate(rng):
+    """A candidate cell as typed in the form, with contact details and noise."""
+    first, last, email = person(rng)
+    name = rng.choice([f"{last} {first}", f"{first} {last}", f"{last}, {first}"])
+    extra = rng.random()
+    if extra < 0.3:
+        name += f" {email}"
+    elif extra < 0.5:
+        name += f" / {phone(rng)}"
+    elif extra < 0.6:
+        name += f"  {email} , {phone(rng)} "
+    return name
+
+
+def write_candidatures(path, departments, lists_per_department, rng):
+    rows = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            ["Titre de la liste", "Département"]
+            + [f"Candidat {i}" for i in range(1, 7)]
+        )
+        for number in departments:
+            for _ in range(lists_per_department):
+                title = " ".join(rng.sample(LIST_WORDS, rng.randint(2, 4)))
+                candidates = [messy_candidate(rng) for _ in range(rng.randint(2, 6))]
+                writer.writerow([f"{title} {number}", number] + candidates)
+                rows += 1
+    return rows
+
+
+def membership_periods(rng):
+    """One or more membership periods, possibly with gaps between them."""
+    start = EXPORT_DATE - datetime.timedelta(days=rng.randint(0, 5 * 365))
+    periods = []
+    for _ in range(rng.choices([1, 2, 3], weights=[80, 15, 5])[0]):
+        end = start + datetime.timedelta(days=rng.randint(30, 2 * 365))
+        periods.append((start, None if end >= EXPORT_DATE else end))
+        if end >= EXPORT_DATE:
+            break
+        start = end + datetime.timedelta(days=rng.randint(1, 120))
+        if start >= EXPORT_DATE:
+            break
+    return periods
+
+
+def write_members(output_dir, folders, members, rng):
+    """Write the global export and the per-department votants files."""
+    writers = {}
+    files = []
+    rows = 0
+    try:
+        for number, folder in folders.items():
+            f = open(
+                os.path.join(output_dir, folder, f"votants_{str(number).zfill(2)}.csv"),
+                "w",
+                encoding="utf-8",
+                newline="",
+            )
+            files.append(f)
+            writers[number] = csv.writer(f)
+            writers[number].writerow(MEMBER_HEADER)
+
+        numbers = list(folders)
+        # A few departments concentrate most of the members, like in real exports
+        weights = [1 / (rank + 1) for rank in range(len(numbers))]
+        with open(
+            os.path.join(output_dir, "adherents.csv"), "w", encoding="utf-8", newline=""
+        ) as f:
+            writer = csv.writer(f)
+            writer.writerow(MEMBER_HEADER)
+            for number in rng.choices(numbers, weights=weights, k=members):
+                first, last, email = person(rng)
+                if rng.random() < 0.01:
+                    email = ""  # Some members have no email
+                elif rng.random() < 0.02:
+                    email = f"  {email.upper()} "
+                for start, end in membership_periods(rng):
+                    row = [
+                        email,
+                        first,
+                        last,
+                        number,
+                        start.isoformat(),
+                        end.isoformat() if end else "",
+                    ]
+                    writer.writerow(row)
+                    writers[number].writerow(row)
+                    rows += 1
+    finally:
+        for f in files:
+            f.close()
+    return rows
+
+
+def generate(output_dir, departments=20, members=10000, lists_per_department=3, seed=0):
+    """Generate a synthetic campaign and return the row counts of its inputs."""
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    numbers = department_numbers(departments)
+    folders = {number: department_folder(number, rng) for number in numbers}
+    for folder in folders.values():
+        os.makedirs(os.path.join(output_dir, folder), exist_ok=True)
+
+    candidature_rows = write_candidatures(
+        os.path.join(output_dir, "candidatures.csv"), numbers, lists_per_department, rng
+    )
+    member_rows = write_members(output_dir, folders, members, rng)
+    return {"candidatures": candidature_rows, "members": member_rows}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic inputs for the preprocessing scripts"
+    )
+    parser.add_argument("output_dir", help="Directory to generate the campaign into")
+    parser.add_argument(
+        "--departments", type=int, default=20, help="Department folders (default: 20)"
+    )
+    parser.add_argument(
+        "--members",
+        type=int,
+        default=10000,
+        help="Members in the export (default: 10000)",
+    )
+    parser.add_argument(
+        "--lists-per-department",
+        type=int,
+        default=3,
+        help="Candidate lists per department (default: 3)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args()
+
+    counts = generate(
+        args.output_dir,
+        args.departments,
+        args.members,
+        args.lists_per_department,
+        args.seed,
+    )
+    print(
+        f"Generated {counts['candidatures']} candidatures and "
+        f"{counts['members']} membership rows in {args.output_dir}"
+    )
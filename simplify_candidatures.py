@@ -1,7 +1,13 @@
+import argparse
+import os
 import re
 
 import pandas as pd
 
+from balotilo import bundle
+from balotilo.compression import open_input, strip_compression_suffix
+from balotilo.profiling import profiler
+
 # Script to simplify the first name last name field for candidates
 
 
@@ -47,42 +53,96 @@ def pad_department_number(num):
     return num_str.zfill(2)
 
 
-# Read the CSV file
-input_file = "candidatures.csv"
-output_file = "candidatures_cleaned.csv"
-
-# Read the CSV
-df = pd.read_csv(input_file)
-
-# Display original column names for reference
-print("Original columns:")
-for i, col in enumerate(df.columns):
-    print(f"Column {i}: {col}")
-
-# Pad department numbers (column index 1)
-df.iloc[:, 1] = df.iloc[:, 1].apply(pad_department_number)
-
-# Clean candidate information (columns 2 to 7, which are indices 2-7)
-for i in range(2, 8):
-    if i < len(df.columns):
-        df.iloc[:, i] = df.iloc[:, i].apply(clean_candidate_info)
-
-# Save the cleaned CSV
-df.to_csv(output_file, index=False)
-
-print(f"\nCleaning complete! Cleaned file saved as: {output_file}")
-
-# Display a sample of the cleaned data
-print("\nSample of cleaned data (first 5 rows):")
-print(df.head())
-
-# Show some examples of the cleaning
-print("\nExamples of cleaned names:")
-for i in range(2, min(8, len(df.columns))):
-    col_name = df.columns[i]
-    # Get first non-null value from the column
-    sample_values = df.iloc[:, i].dropna().head(3)
-    if not sample_values.empty:
-        print(f"\nColumn {i} samples:")
-        for val in sample_values:
-            print(f"  - {val}")
+def clean_candidatures(input_file, output_file, use_bundle=False):
+    """
+    Read the candidatures CSV, clean department numbers and candidate names,
+    and save the cleaned CSV (and its msgpack equivalent with use_bundle)
+    """
+    # Read the CSV
+    with open_input(input_file) as f:
+        df = pd.read_csv(f)
+
+    # Display original column names for reference
+    print("Original columns:")
+    for i, col in enumerate(df.columns):
+        print(f"Column {i}: {col}")
+
+    # Pad department numbers (column index 1)
+    # Columns are replaced whole, as the padded strings do not fit an integer column
+    df[df.columns[1]] = df.iloc[:, 1].apply(pad_department_number)
+
+    # Clean candidate information (columns 2 to 7, which are indices 2-7)
+    for i in range(2, 8):
+        if i < len(df.columns):
+            df[df.columns[i]] = df.iloc[:, i].apply(clean_candidate_info)
+
+    # Save the cleaned CSV
+    df.to_csv(output_file, index=False)
+
+    print(f"\nCleaning complete! Cleaned file saved as: {output_file}")
+
+    if use_bundle:
+        # Same rows as the CSV, header included, empty cells as empty strings
+        rows_file = (
+            os.path.splitext(strip_compression_suffix(output_file))[0]
+            + bundle.ROWS_SUFFIX
+        )
+        cells = df.astype(str).where(df.notna(), "")
+        bundle.write_rows(rows_file, [list(df.columns)] + cells.values.tolist())
+        print(f"Cleaned rows also saved as: {rows_file}")
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Clean the first name last name fields of the candidatures CSV"
+    )
+    parser.add_argument(
+        "--input",
+        default="candidatures.csv",
+        help="Candidatures CSV to clean, possibly compressed (default: candidatures.csv)",
+    )
+    parser.add_argument(
+        "--output",
+        default="candidatures_cleaned.csv",
+        help="Cleaned CSV to write (default: candidatures_cleaned.csv)",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="Profile the cleaning (CPU and memory) and write the reports to DIR",
+    )
+    parser.add_argument(
+        "--bundle",
+        action="store_true",
+        help="Also write the cleaned rows in msgpack, read by sort_lists.py --bundle",
+    )
+    args = parser.parse_args()
+
+    if args.profile:
+        profiler.enable(args.profile)
+
+    with profiler.phase("CSV clean"):
+        df = clean_candidatures(args.input, args.output, args.bundle)
+
+    # Display a sample of the cleaned data
+    print("\nSample of cleaned data (first 5 rows):")
+    print(df.head())
+
+    # Show some examples of the cleaning
+    print("\nExamples of cleaned names:")
+    for i in range(2, min(8, len(df.columns))):
+        col_name = df.columns[i]
+        # Get first non-null value from the column
+        sample_values = df.iloc[:, i].dropna().head(3)
+        if not sample_values.empty:
+            print(f"\nColumn {i} samples:")
+            for val in sample_values:
+                print(f"  - {val}")
+
+    if args.profile:
+        print(f"\n{profiler.write_reports()}")
+
+
+if __name__ == "__main__":
+    main()
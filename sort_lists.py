@@ -1,9 +1,14 @@
+import argparse
 import csv
 import os
 from pathlib import Path
 
 import yaml
 
+from balotilo import bundle
+from balotilo.compression import open_input, strip_compression_suffix
+from balotilo.profiling import profiler
+
 # takes a global candidates csv, and splits it into per-department yamls in subfolders
 # as expected by the script creating the elections on Balotilo
 
@@ -27,80 +32,129 @@ def find_department_folder(department_num):
     return None
 
 
-def process_csv_to_yaml(input_csv):
+def read_candidate_rows(input_csv, use_bundle=False):
+    """
+    Rows of the candidates CSV, or of its msgpack equivalent written by
+    simplify_candidatures.py --bundle if there is one
+    """
+    rows_file = (
+        os.path.splitext(strip_compression_suffix(input_csv))[0] + bundle.ROWS_SUFFIX
+    )
+    if use_bundle and os.path.exists(rows_file):
+        print(f"Reading rows from {rows_file}")
+        yield from bundle.read_rows(rows_file)
+        return
+
+    with open_input(input_csv, newline="") as csvfile:
+        # Use csv.reader to handle quoted fields properly
+        yield from csv.reader(csvfile)
+
+
+def process_csv_to_yaml(input_csv, use_bundle=False):
     """
-    Process CSV file and convert to YAML format in appropriate folders
+    Process CSV file and convert to YAML format in appropriate folders,
+    or to the candidate lists of the folder bundles with use_bundle
     """
     # Track processed departments
     processed = []
+    # Candidate lists of each folder, written once at the end with use_bundle
+    bundle_lists = {}
 
-    with open(input_csv, "r", encoding="utf-8") as csvfile:
-        # Use csv.reader to handle quoted fields properly
-        reader = csv.reader(csvfile)
-
-        for row in reader:
-            if len(row) < 3:  # Skip empty or incomplete rows
-                continue
-
-            # Extract data from row
-            list_title = row[0].strip()
-            department = row[1].strip()
-            candidates = [name.strip() for name in row[2:] if name.strip()]
-
-            # Find the appropriate folder
-            folder = find_department_folder(department)
-            if not folder:
-                continue
-
-            # Prepare YAML data
-            yaml_data = {list_title: candidates}
-
-            # Path to candidates.yaml file
-            yaml_file = folder / "candidates.yaml"
-
-            # Check if file exists
-            if yaml_file.exists():
-                # Read existing content
-                with open(yaml_file, "r", encoding="utf-8") as f:
-                    existing_content = f.read()
-
-                # Append new content
-                with open(yaml_file, "a", encoding="utf-8") as f:
-                    # Add a newline if file doesn't end with one
-                    if existing_content and not existing_content.endswith("\n"):
-                        f.write("\n")
-                    # Write the new YAML data
-                    yaml.dump(
-                        yaml_data,
-                        f,
-                        default_flow_style=False,
-                        allow_unicode=True,
-                        sort_keys=False,
-                    )
-
-                print(f"Appended to {yaml_file}")
-            else:
-                # Create new file
-                with open(yaml_file, "w", encoding="utf-8") as f:
-                    yaml.dump(
-                        yaml_data,
-                        f,
-                        default_flow_style=False,
-                        allow_unicode=True,
-                        sort_keys=False,
-                    )
-
-                print(f"Created {yaml_file}")
+    for row in read_candidate_rows(input_csv, use_bundle):
+        if len(row) < 3:  # Skip empty or incomplete rows
+            continue
+
+        # Extract data from row
+        list_title = row[0].strip()
+        department = row[1].strip()
+        candidates = [name.strip() for name in row[2:] if name.strip()]
+
+        # Find the appropriate folder
+        folder = find_department_folder(department)
+        if not folder:
+            continue
 
+        if use_bundle:
+            bundle_lists.setdefault(folder, {})[list_title] = candidates
             processed.append(department)
+            continue
+
+        # Prepare YAML data
+        yaml_data = {list_title: candidates}
+
+        # Path to candidates.yaml file
+        yaml_file = folder / "candidates.yaml"
+
+        # Check if file exists
+        if yaml_file.exists():
+            # Read existing content
+            with open(yaml_file, "r", encoding="utf-8") as f:
+                existing_content = f.read()
+
+            # Append new content
+            with open(yaml_file, "a", encoding="utf-8") as f:
+                # Add a newline if file doesn't end with one
+                if existing_content and not existing_content.endswith("\n"):
+                    f.write("\n")
+                # Write the new YAML data
+                yaml.dump(
+                    yaml_data,
+                    f,
+                    default_flow_style=False,
+                    allow_unicode=True,
+                    sort_keys=False,
+                )
+
+            print(f"Appended to {yaml_file}")
+        else:
+            # Create new file
+            with open(yaml_file, "w", encoding="utf-8") as f:
+                yaml.dump(
+                    yaml_data,
+                    f,
+                    default_flow_style=False,
+                    allow_unicode=True,
+                    sort_keys=False,
+                )
+
+            print(f"Created {yaml_file}")
+
+        processed.append(department)
+
+    for folder, candidates_data in bundle_lists.items():
+        bundle.update_bundle(folder, candidates=candidates_data)
+        print(f"Wrote {len(candidates_data)} lists to {folder / bundle.BUNDLE_FILE}")
 
     print(f"\nProcessed {len(processed)} departments: {', '.join(processed)}")
 
 
 # Example usage
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Split a global candidates CSV into per-department YAML files"
+    )
+    parser.add_argument(
+        "--input",
+        default="candidatures_cleaned.csv",
+        help="Candidates CSV to split, possibly compressed (default: candidatures_cleaned.csv)",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="Profile the split (CPU and memory) and write the reports to DIR",
+    )
+    parser.add_argument(
+        "--bundle",
+        action="store_true",
+        help=f"Write the lists to each folder {bundle.BUNDLE_FILE} instead of YAML",
+    )
+    args = parser.parse_args()
+
+    if args.profile:
+        profiler.enable(args.profile)
+
     # Input CSV file name
-    input_file = "candidatures_cleaned.csv"  # Change this to your actual CSV filename
+    input_file = args.input
 
     # Check if file exists
     if not os.path.exists(input_file):
@@ -108,9 +162,13 @@ if __name__ == "__main__":
         print("Please make sure the CSV file is in the current directory.")
     else:
         print(f"Processing {input_file}...")
-        process_csv_to_yaml(input_file)
+        with profiler.phase("split"):
+            process_csv_to_yaml(input_file, args.bundle)
         print("\nConversion complete!")
 
+    if args.profile:
+        print(f"\n{profiler.write_reports()}")
+
     # Show example of what was created
     print("\nExample YAML output format:")
     example_yaml = {
@@ -0,0 +1,154 @@
+import gzip
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "balotilo")
+)
+
+import cassette
+from main import BalotiloAutomation
+from sync import ElectionSync
+
+# A run is recorded against a local server serving pages shaped like the
+# Balotilo ones, then replayed from its cassette without any server, through the
+# same parsers. The recorded cassette must not hold any credential or token.
+
+PASSWORD = "correct-horse-battery"
+TOKEN = "k9VxQm2RtL8w"
+SESSION_COOKIE = "a1b2c3d4e5f6"
+
+HEAD = (
+    '<html><head><meta name="csrf-param" content="authenticity_token">'
+    f'<meta name="csrf-token" content="{TOKEN}"><title>Balotilo</title></head><body>'
+)
+PAGES = {
+    "/": HEAD + "Welcome",
+    "/login": HEAD
+    + 'Log in<form class="new_user_session" action="/user_session" method="post">'
+    f'<input type="hidden" name="authenticity_token" value="{TOKEN}">'
+    '<input type="email" name="user_session[email]">'
+    '<input type="password" name="user_session[password]">'
+    '<input type="submit" name="commit" value="Log in"></form>',
+    "/consultations": HEAD + "My elections",
+    "/consultations/ABC": HEAD + "Election",
+    "/consultations/ABC/voters": HEAD
+    + "<table><tr><td>first@example.org</td></tr></table>"
+    '<a rel="next" href="/consultations/ABC/voters?page=2">Next</a>',
+    "/consultations/ABC/voters?page=2": HEAD
+    + "<table><tr><td>second@example.org</td></tr></table>",
+    "/consultations/ABC/edit": HEAD
+    + '<form id="edit_consultation_1" action="/consultations/ABC" method="post">'
+    f'<input type="hidden" name="authenticity_token" value="{TOKEN}">'
+    '<input name="consultation[questions_attributes][0][id]" value="9">'
+    '<input name="consultation[questions_attributes][0][list_voting_lists_attributes][0][id]" value="5">'
+    '<textarea name="consultation[questions_attributes][0][list_voting_lists_attributes][0][title]">'
+    "&lt;p&gt;Liste A&lt;/p&gt;</textarea>"
+    '<textarea name="consultation[questions_attributes][0][list_voting_lists_attributes][0][joined_candidates]">'
+    "&lt;p&gt;Ada&lt;br&gt;Grace&lt;/p&gt;</textarea>"
+    '<input type="submit" name="commit" value="Save"></form>',
+}
+REDIRECTS = {
+    "/locale": "/",
+    "/user_session": "/consultations",
+    "/consultations/ABC/import_new_voters": "/consultations/ABC",
+}
+
+
+class BalotiloHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body="", location=None):
+        content = body.encode("utf-8")
+        self.send_response(status)
+        if location:
+            self.send_header("Location", location)
+        self.send_header("Set-Cookie", f"_balotilo_session={SESSION_COOKIE}; Path=/")
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path in PAGES:
+            self.reply(200, PAGES[self.path])
+        else:
+            self.reply(404, "Not found")
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path in REDIRECTS:
+            self.reply(302, location=REDIRECTS[self.path])
+        else:
+            self.reply(404, "Not found")
+
+
+def run_session(automation):
+    """The exchanges recorded and replayed, returning what the parsers found."""
+    election = ElectionSync(automation, "ABC", None)
+    return {
+        "login": automation.login(),
+        "import": automation._import_voters("ABC", "new@example.org"),
+        "voters": election.fetch_voters(),
+        "lists": election.fetch_form()[2],
+    }
+
+
+class CassetteReplayTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.tmp_dir.name, "run.jsonl.gz")
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), BalotiloHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        cls.base_url = f"http://127.0.0.1:{server.server_port}"
+        try:
+            automation = BalotiloAutomation(
+                "organizer@example.org", PASSWORD, cls.base_url
+            )
+            cassette.attach(automation.session, cls.path, mode="record")
+            cls.recorded = run_session(automation)
+            automation.session.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_recorded_run(self):
+        self.assertTrue(self.recorded["login"])
+        self.assertTrue(self.recorded["import"])
+
+    def test_secrets_scrubbed(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            recorded = f.read()
+        for secret in (PASSWORD, TOKEN, SESSION_COOKIE):
+            self.assertNotIn(secret, recorded)
+
+    def test_replay(self):
+        # The server is gone, every request is answered from the cassette
+        automation = BalotiloAutomation("organizer@example.org", "", self.base_url)
+        cassette.attach(automation.session, self.path, mode="replay")
+        player = automation.session.get_adapter(self.base_url)
+
+        replayed = run_session(automation)
+
+        self.assertEqual(replayed, self.recorded)
+        self.assertEqual(
+            replayed["voters"], {"first@example.org", "second@example.org"}
+        )
+        self.assertEqual(replayed["lists"]["Liste A"]["candidates"], ["Ada", "Grace"])
+        self.assertEqual(player.remaining(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from filter_eligible_voters import compute_eligibility, read_members
+
+# Hand-built member export covering the eligibility edge cases, assessed on
+# 2025-06-01: 3 months of membership are then 92 days, and memberships ended
+# more than 31 days before (on 2025-05-01 or earlier) are lapsed.
+
+CUTOFF = "2025-06-01"
+EXPORT = """\
+Email,Prénom,Nom,Département,Date d'adhésion,Date de fin d'adhésion
+exact@example.org,Ada,Exact,13,2025-03-01,
+short@example.org,Bob,Short,13,2025-03-07,
+chained@example.org,Cy,Chained,13,2025-01-01,2025-02-15
+chained@example.org,Cy,Chained,13,2025-03-10,
+broken@example.org,Di,Broken,13,2024-01-01,2025-01-31
+broken@example.org,Di,Broken,13,2025-03-15,
+overlap@example.org,Ed,Overlap,13,2025-02-01,2025-04-01
+overlap@example.org,Ed,Overlap,13,2025-03-01,
+lapsed@example.org,Flo,Lapsed,13,2023-01-01,2025-04-15
+recent@example.org,Gil,Recent,13,2025-01-01,2025-05-15
+Moved@Example.org,Hal,Moved,13,2025-01-01,2025-02-01
+moved@example.org,Hal,Moved,5,2025-02-01,
+future@example.org,Ivy,Future,13,2025-07-01,
+,Jo,NoEmail,13,2020-01-01,
+"""
+
+# email -> (department, days, eligible, reason)
+EXPECTED = {
+    # Exactly 3 months, ongoing memberships counting up to the cutoff date
+    "exact@example.org": ("13", 92, True, ""),
+    # 2 months 25 days
+    "short@example.org": ("13", 86, False, "86 days of membership, 92 required"),
+    # 23 days gap, within the tolerance: 45 + 83 days
+    "chained@example.org": ("13", 128, True, ""),
+    # 43 days gap: only the latest membership counts
+    "broken@example.org": ("13", 78, False, "78 days of membership, 92 required"),
+    # Overlapping periods are counted once, from 2025-02-01
+    "overlap@example.org": ("13", 120, True, ""),
+    "lapsed@example.org": ("13", 835, False, "membership ended on 2025-04-15"),
+    # Ended within the tolerance before the cutoff date
+    "recent@example.org": ("13", 134, True, ""),
+    # Same member whatever the case of the email, in the department of the
+    # latest membership
+    "moved@example.org": ("05", 151, True, ""),
+    "future@example.org": (
+        "13",
+        0,
+        False,
+        "no membership period before the cutoff date",
+    ),
+    "": ("13", 0, False, "no email"),
+}
+
+
+class ComputeEligibilityTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "adherents.csv")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(EXPORT)
+            cls.members = compute_eligibility(read_members(path), CUTOFF)
+
+    def test_one_row_per_member(self):
+        self.assertEqual(sorted(self.members["email"]), sorted(EXPECTED))
+
+    def test_eligibility(self):
+        results = {
+            row.email: (row.department, row.days, row.eligible, row.reason)
+            for row in self.members.itertuples()
+        }
+        self.assertEqual(results, EXPECTED)
+
+
+if __name__ == "__main__":
+    unittest.main()